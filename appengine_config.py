@@ -0,0 +1,11 @@
+"""appengine_config.py
+Adds third-party libraries installed in lib/ (e.g. the GCS client library
+used by bulk.py) to the import path.
+"""
+
+import os
+
+from google.appengine.ext import vendor
+
+if os.path.isdir(os.path.join(os.path.dirname(__file__), 'lib')):
+    vendor.add('lib')
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+"""common.py
+Shared setup for the Conference Central benchmarks
+
+The benchmarks run fully offline on the App Engine testbed stubs. Run them
+from the app directory with the App Engine SDK on PYTHONPATH, e.g.:
+
+    PYTHONPATH=$APPENGINE_SDK python benchmarks/wishlist_filter.py
+"""
+
+import collections
+import os
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+# put the SDK's bundled libraries (webapp2, endpoints, ...) on the path:
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+BENCH_USER_EMAIL = 'bench@example.com'
+
+
+def setUpTestbed():
+    """Activate the datastore, memcache, taskqueue, urlfetch, mail and
+    search stubs and log in the benchmark user; returns the Testbed
+    (deactivate when done).
+    """
+
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_datastore_v3_stub()
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=APP_DIR)
+    tb.init_urlfetch_stub()
+    tb.init_app_identity_stub()
+    tb.init_mail_stub()
+    tb.init_search_stub()
+    logIn(BENCH_USER_EMAIL)
+    return tb
+
+
+def logIn(email):
+    """Make the given user the endpoints' current user."""
+
+    # endpoints.get_current_user() reads these:
+    os.environ['ENDPOINTS_AUTH_EMAIL'] = email
+    os.environ['ENDPOINTS_AUTH_DOMAIN'] = ''
+
+
+def clearCaches(flush_memcache=False):
+    """Drop ndb's in-context cache, as if a new request started, and
+    optionally empty memcache too."""
+
+    ndb.get_context().clear_cache()
+    if flush_memcache:
+        memcache.flush_all()
+
+
+class RpcStats(object):
+    """Counts the API calls made through the API proxy (by service and
+    method), and the datastore entities they read and wrote."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = collections.Counter()
+        self.entitiesRead = 0
+        self.entitiesWritten = 0
+
+    def _postCall(self, service, call, request, response):
+        self.calls['%s.%s' % (service, call)] += 1
+        if service != 'datastore_v3':
+            return
+        if call == 'Get':
+            self.entitiesRead += sum(1 for e in response.entity_list()
+                                     if e.has_entity())
+        elif call in ('RunQuery', 'Next'):
+            self.entitiesRead += response.result_size()
+        elif call == 'Put':
+            self.entitiesWritten += request.entity_size()
+        elif call == 'Delete':
+            self.entitiesWritten += request.key_size()
+
+    def serviceCalls(self, service):
+        """Return the number of calls made to the service."""
+        return sum(count for name, count in self.calls.items()
+                   if name.split('.')[0] == service)
+
+    def summary(self):
+        """Return the counts as a JSON-serializable dict."""
+
+        return {
+            'datastore_rpcs': self.serviceCalls('datastore_v3'),
+            'entities_read': self.entitiesRead,
+            'entities_written': self.entitiesWritten,
+            'memcache_ops': self.serviceCalls('memcache'),
+            'taskqueue_rpcs': self.serviceCalls('taskqueue'),
+            'search_rpcs': self.serviceCalls('search'),
+            'calls': dict(self.calls),
+        }
+
+
+def countRpcs():
+    """Start counting the API calls of the active testbed; returns the
+    RpcStats."""
+
+    stats = RpcStats()
+    apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+        'bench_rpc_stats', stats._postCall)
+    return stats
+
+
+def timeCall(func, repeat=5):
+    """Call func repeat times (each as a fresh request); return the best
+    wall time in seconds."""
+
+    best = None
+    for _ in range(repeat):
+        clearCaches()
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
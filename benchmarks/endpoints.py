@@ -0,0 +1,434 @@
+#!/usr/bin/env python
+
+"""endpoints.py
+Benchmark suite for every ConferenceApi endpoint
+
+Seeds synthetic catalogs of several sizes (conferences, sessions per
+conference, profiles and the benchmark user's wishlist length) through the
+API itself, then calls each endpoint as the benchmark user and records its
+wall time, datastore RPCs, entities read and written, and memcache,
+taskqueue and search calls. Each endpoint is measured cold (memcache empty)
+and warm (memcache filled by an earlier call), as a fresh request each time.
+
+The results are written as JSON, so runs can be compared, e.g.:
+
+    PYTHONPATH=$APPENGINE_SDK python benchmarks/endpoints.py \\
+        --output before.json
+    PYTHONPATH=$APPENGINE_SDK python benchmarks/endpoints.py \\
+        --output after.json --compare before.json
+"""
+
+import common
+
+import argparse
+import collections
+import datetime
+import inspect
+import json
+import os
+import random
+import time
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from protorpc import message_types
+
+from conference import CONF_ATTENDEES_REQUEST, CONF_CONDITIONAL_GET_REQUEST
+from conference import CONF_GET_REQUEST, CONF_POST_REQUEST
+from conference import PROFILE_GET_REQUEST, SEARCH_REQUEST
+from conference import SESSION_DELETE_REQUEST, SESSION_GET_REQUEST
+from conference import SESSION_GET_REQUEST_BY_TYPE, SESSION_POST_REQUEST
+from conference import SESSION_SPEAKER_GET_REQUEST, SESSION_SPEAKER_REQUEST
+from conference import SESSION_WISH_LIST_POST_REQUEST, SESSIONS_POST_REQUEST
+from conference import WISHLIST_GET_REQUEST_BY_DATE
+from conference import WISHLIST_GET_REQUEST_BY_TYPE
+from conference import ConferenceApi
+import instrumentation
+from models import Conference, ConferenceForm, ConferenceQueryForm
+from models import ConferenceQueryForms, Profile, ProfileMiniForm, Session
+from models import SessionForm, SessionQueryForm, SessionQueryForms
+from models import TeeShirtSize
+from profiles import attendanceKey
+from speakers import addSpeakerSessions
+
+SIZES = collections.OrderedDict([
+    ('small', {'conferences': 10, 'sessions': 5, 'profiles': 10,
+               'wishlist': 5}),
+    ('medium', {'conferences': 100, 'sessions': 20, 'profiles': 100,
+                'wishlist': 50}),
+    ('large', {'conferences': 500, 'sessions': 50, 'profiles': 500,
+               'wishlist': 200}),
+])
+DEFAULT_SIZES = 'small,medium'
+REGISTRATIONS_PER_PROFILE = 3
+SESSIONS_PER_BATCH = 10
+CITIES = ['London', 'Paris', 'Tokyo', 'Chicago']
+TOPICS = ['Web', 'Python', 'Cloud', 'Mobile', 'Medical Innovations']
+TYPES = ['lecture', 'keynote', 'workshop']
+SPEAKERS = ['Speaker %d' % i for i in range(50)]
+FIRST_DATE = datetime.date(2017, 1, 1)
+VOID = message_types.VoidMessage()
+
+
+def profileEmail(i):
+    """Return the email of the i-th seeded profile (the first one is the
+    benchmark user)."""
+
+    if i == 0:
+        return common.BENCH_USER_EMAIL
+    return 'user%d@example.com' % i
+
+
+def conferenceForm(i, max_attendees=100):
+    start = FIRST_DATE + datetime.timedelta(days=i % 365)
+    return ConferenceForm(
+        name='conference %d' % i,
+        description='A conference about %s' % TOPICS[i % len(TOPICS)],
+        topics=[TOPICS[i % len(TOPICS)], TOPICS[(i + 1) % len(TOPICS)]],
+        city=CITIES[i % len(CITIES)],
+        startDate=str(start),
+        endDate=str(start + datetime.timedelta(days=2)),
+        maxAttendees=max_attendees)
+
+
+def sessionForm(i, conf):
+    return SessionForm(
+        name='session %d' % i,
+        date=str(conf.startDate + datetime.timedelta(days=i % 3)),
+        speaker=random.choice(SPEAKERS),
+        startTime='%02d:00' % (9 + i % 10),
+        typeOfSession=random.choice(TYPES),
+        duration='01:00',
+        highlights=['python', 'web'])
+
+
+def call(name, request):
+    """Call the endpoint as a fresh request of the current user."""
+    return getattr(ConferenceApi(), name)(request)
+
+
+class Catalog(object):
+    """The seeded entities the benchmark requests refer to."""
+
+    def __init__(self, conferences, session_keys):
+        self.conferences = conferences
+        self.sessionKeys = session_keys
+        # a conference (with sessions) organized by the benchmark user:
+        self.own = [conf for conf in conferences
+                    if conf.organizerUserId == common.BENCH_USER_EMAIL][0]
+        self.ownKey = self.own.key.urlsafe()
+        self.created = 0
+
+    def randomConference(self):
+        return random.choice(self.conferences).key.urlsafe()
+
+    def newSessionForm(self):
+        self.created += 1
+        return sessionForm(self.created, self.own)
+
+
+def emptyQueues(tb):
+    """Drop the tasks enqueued so far (they aren't run by the testbed)."""
+
+    stub = tb.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+    for queue in stub.GetQueues():
+        stub.FlushQueue(queue['name'])
+
+
+def seedCatalog(tb, size):
+    """Create the size's Conferences, Sessions, Profiles, registrations and
+    the benchmark user's wishlist through the API; returns the Catalog."""
+
+    for i in range(size['profiles']):
+        common.logIn(profileEmail(i))
+        call('saveProfile', ProfileMiniForm(displayName='user %d' % i,
+                                            teeShirtSize=TeeShirtSize.M_M))
+
+    for i in range(size['conferences']):
+        common.logIn(profileEmail(i % size['profiles']))
+        call('createConference', conferenceForm(
+            i, max(100, 2 * size['profiles'])))
+    conferences = Conference.query().fetch()
+
+    for conf in conferences:
+        common.logIn(conf.organizerUserId)
+        call('createSessions', SESSIONS_POST_REQUEST.combined_message_class(
+            websafeConferenceKey=conf.key.urlsafe(),
+            items=[sessionForm(i, conf) for i in range(size['sessions'])]))
+    sessions = Session.query().fetch()
+    # the Speakers are updated in tasks, which the testbed doesn't run:
+    addSpeakerSessions(sessions)
+
+    for i in range(size['profiles']):
+        common.logIn(profileEmail(i))
+        for conf in random.sample(conferences, min(
+                REGISTRATIONS_PER_PROFILE, len(conferences))):
+            call('registerForConference',
+                 CONF_GET_REQUEST.combined_message_class(
+                     websafeConferenceKey=conf.key.urlsafe()))
+
+    common.logIn(common.BENCH_USER_EMAIL)
+    for session_ in random.sample(sessions, size['wishlist']):
+        call('addSessionToWishlist',
+             SESSION_WISH_LIST_POST_REQUEST.combined_message_class(
+                 websafeSessionKey=session_.key.urlsafe()))
+
+    emptyQueues(tb)
+    # the conferences as stored now (seat counts, organizer names):
+    return Catalog(Conference.query().fetch(),
+                   [session_.key for session_ in sessions])
+
+
+# request factories, called (untimed) before each call; some write what
+# the call needs first
+
+def confRequest(container):
+    return lambda cat: container.combined_message_class(
+        websafeConferenceKey=cat.ownKey)
+
+
+def benchProfileKey():
+    return ndb.Key(Profile, common.BENCH_USER_EMAIL)
+
+
+def notModified(name, factory):
+    """Return a factory of the endpoint's requests carrying the etag of
+    its current response."""
+
+    def conditional(cat):
+        request = factory(cat)
+        request.ifNoneMatch = call(name, factory(cat)).etag
+        return request
+    return conditional
+
+
+def profileRequest(cat):
+    return PROFILE_GET_REQUEST.combined_message_class()
+
+
+def registerRequest(cat):
+    wsck = cat.randomConference()
+    request = CONF_GET_REQUEST.combined_message_class(
+        websafeConferenceKey=wsck)
+    if attendanceKey(benchProfileKey(), ndb.Key(urlsafe=wsck)).get():
+        call('unregisterFromConference', request)
+    return request
+
+
+def unregisterRequest(cat):
+    request = registerRequest(cat)
+    call('registerForConference', request)
+    return request
+
+
+def addToWishlistRequest(cat):
+    wish_list = set(benchProfileKey().get().wishListKeys)
+    s_key = random.choice([s_key for s_key in cat.sessionKeys
+                           if s_key not in wish_list])
+    return SESSION_WISH_LIST_POST_REQUEST.combined_message_class(
+        websafeSessionKey=s_key.urlsafe())
+
+
+def createSessionRequest(cat):
+    form = cat.newSessionForm()
+    return SESSION_POST_REQUEST.combined_message_class(
+        websafeConferenceKey=cat.ownKey,
+        **dict((f.name, getattr(form, f.name))
+               for f in SessionForm.all_fields()))
+
+
+def deleteSessionRequest(cat):
+    form = call('createSession', createSessionRequest(cat))
+    return SESSION_DELETE_REQUEST.combined_message_class(
+        websafeSessionKey=form.websafeKey)
+
+
+# (endpoint[:variant], request factory)
+CASES = [
+    ('getProfile', profileRequest),
+    ('getProfile:notModified', notModified('getProfile', profileRequest)),
+    ('saveProfile', lambda cat: ProfileMiniForm(
+        displayName='user 0', teeShirtSize=TeeShirtSize.M_M)),
+    ('createConference', lambda cat: conferenceForm(len(cat.conferences))),
+    ('updateConference', lambda cat: CONF_POST_REQUEST.combined_message_class(
+        websafeConferenceKey=cat.ownKey, description='Updated')),
+    ('getConference', confRequest(CONF_CONDITIONAL_GET_REQUEST)),
+    ('getConference:notModified', notModified(
+        'getConference', confRequest(CONF_CONDITIONAL_GET_REQUEST))),
+    ('queryConferences', lambda cat: ConferenceQueryForms(filters=[
+        ConferenceQueryForm(field='CITY', operator='EQ', value='London'),
+        ConferenceQueryForm(field='MONTH', operator='GT', value='3')])),
+    ('queryConferencesCreated', lambda cat: VOID),
+    ('searchConferences', lambda cat: SEARCH_REQUEST.combined_message_class(
+        query='python')),
+    ('filterPlayground', lambda cat: VOID),
+    ('registerForConference', registerRequest),
+    ('unregisterFromConference', unregisterRequest),
+    ('getConferencesToAttend', lambda cat: VOID),
+    ('getConferenceAttendees', confRequest(CONF_ATTENDEES_REQUEST)),
+    ('getAnnouncement', lambda cat: VOID),
+    ('createSession', createSessionRequest),
+    ('createSessions',
+     lambda cat: SESSIONS_POST_REQUEST.combined_message_class(
+         websafeConferenceKey=cat.ownKey,
+         items=[cat.newSessionForm() for _ in range(SESSIONS_PER_BATCH)])),
+    ('deleteSession', deleteSessionRequest),
+    ('getConferenceSessions', confRequest(SESSION_GET_REQUEST)),
+    ('getConferenceSessions:notModified', notModified(
+        'getConferenceSessions', confRequest(SESSION_GET_REQUEST))),
+    ('getConferenceSessionsByType',
+     lambda cat: SESSION_GET_REQUEST_BY_TYPE.combined_message_class(
+         websafeConferenceKey=cat.ownKey, typeOfSession='workshop')),
+    ('getSessionsBySpeaker',
+     lambda cat: SESSION_SPEAKER_GET_REQUEST.combined_message_class(
+         speaker=SPEAKERS[0])),
+    ('querySessions', lambda cat: SessionQueryForms(filters=[
+        SessionQueryForm(field='TYPE', operator='NE', value='workshop'),
+        SessionQueryForm(field='START_TIME', operator='LT', value='19:00')])),
+    ('searchSessions', lambda cat: SEARCH_REQUEST.combined_message_class(
+        query='python')),
+    ('addSessionToWishlist', addToWishlistRequest),
+    ('getSessionsInWishlist', lambda cat: VOID),
+    ('getSessionsInWishlistByType',
+     lambda cat: WISHLIST_GET_REQUEST_BY_TYPE.combined_message_class(
+         typeOfSession='workshop')),
+    ('getSessionsInWishlistBySpeaker',
+     lambda cat: SESSION_SPEAKER_REQUEST.combined_message_class(
+         speaker=SPEAKERS[0])),
+    ('getSessionsInWishlistByDate',
+     lambda cat: WISHLIST_GET_REQUEST_BY_DATE.combined_message_class(
+         date=str(FIRST_DATE))),
+    ('getSessionsInWishlistByConference', confRequest(CONF_GET_REQUEST)),
+    ('getFeaturedSpeaker', confRequest(CONF_GET_REQUEST)),
+]
+
+
+def endpointNames():
+    """Return the names of all ConferenceApi endpoints."""
+
+    return sorted(name for name, method in inspect.getmembers(ConferenceApi)
+                  if hasattr(method, 'method_info'))
+
+
+def measure(stats, name, factory, catalog, cold, repeat):
+    """Call the endpoint repeat times; returns its result record."""
+
+    endpoint = name.split(':')[0]
+    times = []
+    counts = None
+    if not cold:
+        # fill the caches:
+        call(endpoint, factory(catalog))
+    for _ in range(repeat):
+        request = factory(catalog)
+        common.clearCaches(flush_memcache=cold)
+        stats.reset()
+        start = time.time()
+        call(endpoint, request)
+        times.append(time.time() - start)
+        counts = stats.summary()
+
+    times.sort()
+    record = {
+        'endpoint': name,
+        'mode': 'cold' if cold else 'warm',
+        'wall_ms_best': times[0] * 1000,
+        'wall_ms_median': times[len(times) // 2] * 1000,
+    }
+    record.update(counts)
+    return record
+
+
+def compare(results, baseline):
+    """Print each result against the same measurement of the baseline."""
+
+    old = dict(((r['size'], r['endpoint'], r['mode']), r)
+               for r in baseline['results'] if 'error' not in r)
+    print '\n%-8s %-34s %-5s %10s %10s %10s' % (
+        'size', 'endpoint', 'mode', 'time', 'ds rpcs', 'read')
+    for r in results:
+        o = old.get((r['size'], r['endpoint'], r['mode']))
+        if not o or 'error' in r:
+            continue
+        print '%-8s %-34s %-5s %9.2fx %+10d %+10d' % (
+            r['size'], r['endpoint'], r['mode'],
+            r['wall_ms_median'] / max(o['wall_ms_median'], 1e-3),
+            r['datastore_rpcs'] - o['datastore_rpcs'],
+            r['entities_read'] - o['entities_read'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                        help='comma separated, of: %s' % ', '.join(SIZES))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default=os.path.join(
+        common.APP_DIR, 'benchmarks', 'endpoint_results.json'))
+    parser.add_argument('--compare', metavar='EARLIER_OUTPUT')
+    args = parser.parse_args()
+
+    missing = set(endpointNames()) - set(name.split(':')[0]
+                                         for name, _ in CASES)
+    if missing:
+        print 'not benchmarked: %s' % ', '.join(sorted(missing))
+
+    # its memcache flushes would blur the RPC counts:
+    instrumentation.ENABLED = False
+    random.seed(0)
+    results = []
+    for size_name in args.sizes.split(','):
+        size = SIZES[size_name]
+        tb = common.setUpTestbed()
+        try:
+            start = time.time()
+            catalog = seedCatalog(tb, size)
+            print '\n%s catalog %s seeded in %.1f s' % (
+                size_name, json.dumps(size, sort_keys=True),
+                time.time() - start)
+            print '%-34s %-5s %10s %8s %8s %8s %8s' % (
+                'endpoint', 'mode', 'ms', 'ds rpcs', 'read', 'written',
+                'memcache')
+
+            stats = common.countRpcs()
+            for name, factory in CASES:
+                for cold in (True, False):
+                    try:
+                        record = measure(stats, name, factory, catalog,
+                                         cold, args.repeat)
+                    except Exception as e:
+                        record = {'endpoint': name,
+                                  'mode': 'cold' if cold else 'warm',
+                                  'error': repr(e)}
+                        print '%-34s %-5s %s' % (name, record['mode'],
+                                                 record['error'])
+                    else:
+                        print '%-34s %-5s %10.1f %8d %8d %8d %8d' % (
+                            name, record['mode'], record['wall_ms_median'],
+                            record['datastore_rpcs'],
+                            record['entities_read'],
+                            record['entities_written'],
+                            record['memcache_ops'])
+                    record['size'] = size_name
+                    results.append(record)
+                    emptyQueues(tb)
+        finally:
+            tb.deactivate()
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'created': datetime.datetime.utcnow().isoformat(),
+            'repeat': args.repeat,
+            'sizes': dict((name, SIZES[name])
+                          for name in args.sizes.split(',')),
+            'results': results,
+        }, f, indent=1, sort_keys=True)
+    print '\nresults written to %s' % args.output
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+"""form_converters.py
+Benchmark for the precompiled entity to form converters (converters.py)
+
+Copies 10k in-memory Profiles, Conferences and Sessions to their forms with
+the precompiled converters and with the reflection loops they replaced,
+checks that both give the same forms, and prints the time of each.
+"""
+
+import common
+
+import datetime
+
+from google.appengine.ext import ndb
+
+from conference import CONFERENCE_TO_FORM, PROFILE_TO_FORM, SESSION_TO_FORM
+from models import Conference, ConferenceForm, Profile, ProfileForm
+from models import Session, SessionForm, TeeShirtSize
+
+ENTITIES = 10000
+
+
+# the reflection loops the converters replaced:
+
+def reflectProfile(prof):
+    pf = ProfileForm()
+    for field in pf.all_fields():
+        if hasattr(prof, field.name):
+            if field.name == 'teeShirtSize':
+                setattr(pf, field.name,
+                        getattr(TeeShirtSize, getattr(prof, field.name)))
+            elif field.name == 'wishListKeys':
+                setattr(pf, field.name,
+                        [key.urlsafe() for key in getattr(prof, field.name)])
+            else:
+                setattr(pf, field.name, getattr(prof, field.name))
+    pf.check_initialized()
+    return pf
+
+
+def reflectConference(conf):
+    cf = ConferenceForm()
+    for field in cf.all_fields():
+        if hasattr(conf, field.name):
+            if field.name.endswith('Date'):
+                setattr(cf, field.name, str(getattr(conf, field.name)))
+            else:
+                setattr(cf, field.name, getattr(conf, field.name))
+        elif field.name == "websafeKey":
+            setattr(cf, field.name, conf.key.urlsafe())
+    cf.check_initialized()
+    return cf
+
+
+def reflectSession(session_):
+    sf = SessionForm()
+    for field in sf.all_fields():
+        if hasattr(session_, field.name):
+            if field.name == "date" or field.name == "startTime" or \
+                    field.name == "duration":
+                setattr(sf, field.name, str(getattr(session_, field.name)))
+            else:
+                setattr(sf, field.name, getattr(session_, field.name))
+        elif field.name == "websafeKey":
+            setattr(sf, field.name, session_.key.urlsafe())
+    sf.check_initialized()
+    return sf
+
+
+def makeEntities():
+    """Return (Profiles, Conferences, Sessions), ENTITIES of each, in
+    memory only."""
+
+    profiles = [Profile(key=ndb.Key(Profile, 'user%d' % i),
+                        displayName='user %d' % i,
+                        mainEmail='user%d@example.com' % i,
+                        teeShirtSize='M_M',
+                        wishListKeys=[ndb.Key(Session, 1),
+                                      ndb.Key(Session, 2)])
+                for i in range(ENTITIES)]
+    conferences = [Conference(key=ndb.Key(Conference, i + 1,
+                                          parent=profiles[i].key),
+                              name='conference %d' % i,
+                              organizerUserId='user%d' % i,
+                              topics=['Web', 'Python'],
+                              city='London',
+                              startDate=datetime.date(2016, 6, 1),
+                              month=6,
+                              maxAttendees=100,
+                              seatsAvailable=50)
+                   for i in range(ENTITIES)]
+    sessions = [Session(key=ndb.Key(Session, i + 1,
+                                    parent=conferences[i].key),
+                        name='session %d' % i,
+                        date=datetime.date(2016, 6, 1),
+                        speaker='speaker %d' % (i % 50),
+                        startTime=datetime.time(9, 30),
+                        typeOfSession='lecture',
+                        duration=datetime.time(1, 0),
+                        highlights=['one', 'two'])
+                for i in range(ENTITIES)]
+    return profiles, conferences, sessions
+
+
+def main():
+    tb = common.setUpTestbed()
+    try:
+        profiles, conferences, sessions = makeEntities()
+        cases = [
+            ('Profile', profiles, reflectProfile, PROFILE_TO_FORM),
+            ('Conference', conferences, reflectConference,
+             CONFERENCE_TO_FORM),
+            ('Session', sessions, reflectSession, SESSION_TO_FORM),
+        ]
+
+        print '%d entities of each kind' % ENTITIES
+        print '%12s %16s %16s %8s' % (
+            'kind', 'reflection (ms)', 'converter (ms)', 'speedup')
+        for kind, entities, reflect, convert in cases:
+            # both must give the same forms:
+            assert ([reflect(e) for e in entities[:100]] ==
+                    [convert(e) for e in entities[:100]]), kind
+
+            reflect_time = common.timeCall(
+                lambda: [reflect(e) for e in entities])
+            convert_time = common.timeCall(
+                lambda: [convert(e) for e in entities])
+            print '%12s %16.1f %16.1f %7.1fx' % (
+                kind, reflect_time * 1000, convert_time * 1000,
+                reflect_time / convert_time)
+    finally:
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
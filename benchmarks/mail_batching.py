@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+"""mail_batching.py
+Benchmark for batched mail delivery (mailer.py)
+
+Queues a burst of confirmation mails for a few recipients, runs the mail
+worker on the testbed's pull queue and mail stubs, and prints how many mail
+API calls the burst took.
+"""
+
+import common
+
+from google.appengine.ext import testbed
+
+from conference import CONFIRMATION_BODY, CONFIRMATION_SUBJECT
+from mailer import queueMail, sendQueuedMail
+
+MAILS = 1000
+RECIPIENTS = 20
+
+
+def main():
+    tb = common.setUpTestbed()
+    try:
+        for i in range(MAILS):
+            queueMail('organizer%d@example.com' % (i % RECIPIENTS),
+                      CONFIRMATION_SUBJECT,
+                      CONFIRMATION_BODY % ('conference %d' % i))
+
+        elapsed = common.timeCall(sendQueuedMail, repeat=1)
+        sent = tb.get_stub(testbed.MAIL_SERVICE_NAME).get_sent_messages()
+        print '%d mails queued for %d recipients' % (MAILS, RECIPIENTS)
+        print '%d mail API calls in %.1f ms' % (len(sent), elapsed * 1000)
+    finally:
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+"""wishlist_filter.py
+Benchmark for the wishlist filters (getSessionsInWishlistByType,
+getSessionsInWishlistBySpeaker)
+
+Seeds a fixed catalog of Sessions and times the filters for growing
+wishlists. As the filters only read the wishlist (and the Speaker), the time
+per wishlist item should stay roughly flat, whatever the catalog size.
+"""
+
+import common
+
+import random
+
+from google.appengine.ext import ndb
+
+from conference import ConferenceApi
+from conference import SESSION_SPEAKER_REQUEST, WISHLIST_GET_REQUEST_BY_TYPE
+from models import Conference, Profile, Session
+from speakers import addSpeakerSessions
+
+CONFERENCES = 20
+SESSIONS_PER_CONFERENCE = 100
+WISHLIST_SIZES = [10, 100, 500, 1000, 2000]
+TYPES = ['lecture', 'keynote', 'workshop']
+SPEAKERS = ['speaker %d' % i for i in range(50)]
+
+
+def seedCatalog():
+    """Put the Conferences and Sessions; return all Session keys."""
+
+    p_key = ndb.Key(Profile, common.BENCH_USER_EMAIL)
+    session_keys = []
+    for c in range(CONFERENCES):
+        c_key = Conference(parent=p_key, name='conference %d' % c).put()
+        sessions = [Session(parent=c_key,
+                            name='session %d' % s,
+                            typeOfSession=random.choice(TYPES),
+                            speaker=random.choice(SPEAKERS))
+                    for s in range(SESSIONS_PER_CONFERENCE)]
+        session_keys.extend(ndb.put_multi(sessions))
+        addSpeakerSessions(sessions)
+    return session_keys
+
+
+def main():
+    tb = common.setUpTestbed()
+    try:
+        session_keys = seedCatalog()
+        by_type = WISHLIST_GET_REQUEST_BY_TYPE.combined_message_class(
+            typeOfSession='workshop')
+        by_speaker = SESSION_SPEAKER_REQUEST.combined_message_class(
+            speaker=SPEAKERS[0])
+
+        print 'catalog: %d sessions' % len(session_keys)
+        print '%10s %14s %14s %14s' % (
+            'wishlist', 'by type (ms)', 'by speaker', 'per item (us)')
+        for size in WISHLIST_SIZES:
+            Profile(key=ndb.Key(Profile, common.BENCH_USER_EMAIL),
+                    displayName='bench',
+                    mainEmail=common.BENCH_USER_EMAIL,
+                    wishListKeys=random.sample(session_keys, size)).put()
+
+            def run(request, method):
+                # a fresh ConferenceApi per call, as per request
+                return lambda: method(ConferenceApi(), request)
+
+            type_time = common.timeCall(
+                run(by_type, ConferenceApi.getSessionsInWishlistByType))
+            speaker_time = common.timeCall(
+                run(by_speaker, ConferenceApi.getSessionsInWishlistBySpeaker))
+            print '%10d %14.1f %14.1f %14.1f' % (
+                size, type_time * 1000, speaker_time * 1000,
+                type_time * 1e6 / size)
+    finally:
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
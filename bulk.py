@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+
+"""bulk.py
+Bulk export and import of Conferences, with their Sessions, as JSONL
+
+Each line holds one Conference and its Sessions. A job runs as a chain of
+tasks, one batch of BULK_BATCH_SIZE conferences per step, so memory stays
+bounded whatever the size of the catalog. A BulkJob entity records where the
+next step starts (a query cursor when exporting, a file and byte offset when
+importing); each step records its progress and enqueues the next step in one
+transaction. A step that dies is retried from its own start, and a job whose
+chain broke off can be resumed from the last recorded position.
+
+Exports are written to Google Cloud Storage as one part file per step, and
+imports read every file under a path prefix in name order, so an export can
+be imported as is. Keys are kept, so importing the same lines twice is
+harmless. Needs the GCS client library (GoogleAppEngineCloudStorageClient)
+installed in lib/.
+"""
+
+from datetime import date as date_
+from datetime import datetime
+from datetime import time as time_
+import json
+
+from google.appengine.api import app_identity
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+try:
+    import cloudstorage as gcs
+except ImportError:
+    gcs = None
+
+from formcache import invalidateMany
+from models import BulkJob, Conference, Session
+from schedules import scheduleKey, sessionStart
+from seats import MEMCACHE_SEATS_KEY, getSeatsAvailable, newSeatShards
+from speakers import MEMCACHE_FEATURED_SPEAKER_KEY, addSpeakerSessions
+from speakers import speakerIndexKey
+from textsearch import indexConferences, indexSessions
+
+BULK_BATCH_SIZE = 50
+STEP_URLS = {
+    'export': '/tasks/bulk_export',
+    'import': '/tasks/bulk_import',
+}
+# derived properties, rebuilt on import
+CONFERENCE_EXCLUDE = ('seatShards',)
+SESSION_EXCLUDE = ('startDateTime',)
+
+
+def _entityToJson(entity, exclude=()):
+    """Return the entity's properties as a JSON-serializable dict."""
+
+    data = entity.to_dict(exclude=exclude)
+    for name, value in data.items():
+        # dates and times as ISO strings:
+        if isinstance(value, (date_, time_)):
+            data[name] = value.isoformat()
+    return data
+
+
+def _entityFromJson(model, key, data):
+    """Return a new entity of model with the given key from a dict made by
+    _entityToJson; unknown properties are ignored."""
+
+    values = {}
+    for name, value in data.items():
+        prop = model._properties.get(name)
+        if prop is None:
+            continue
+        if value is not None and isinstance(prop, ndb.DateProperty):
+            value = datetime.strptime(value[:10], "%Y-%m-%d").date()
+        elif value is not None and isinstance(prop, ndb.TimeProperty):
+            value = datetime.strptime(value[:8], "%H:%M:%S").time()
+        values[name] = value
+    return model(key=key, **values)
+
+
+def _conferenceRecord(conf, sessions):
+    """Return the JSONL record of a Conference and its Sessions."""
+
+    return {
+        'key': list(conf.key.flat()),
+        'conference': _entityToJson(conf, CONFERENCE_EXCLUDE),
+        'sessions': [dict(_entityToJson(session_, SESSION_EXCLUDE),
+                          id=session_.key.id())
+                     for session_ in sessions],
+    }
+
+
+def _putConferenceRecords(records):
+    """Store Conferences and their Sessions from JSONL records.
+
+    Seat shards are rebuilt from seatsAvailable and the Sessions'
+    startDateTime from their date and startTime, the entities are added to
+    the search index and the Sessions to their Speakers, and each
+    conference's speaker index, schedule and cached entries are dropped, to
+    be rebuilt on first use.
+    """
+
+    entities = []
+    conferences = []
+    all_sessions = []
+    c_keys = []
+    allocations = []
+    for record in records:
+        c_key = ndb.Key(flat=record['key'])
+        conf = _entityFromJson(Conference, c_key, record['conference'])
+        conf.seatShards, shards = newSeatShards(
+            c_key, conf.seatsAvailable or 0, conf.maxAttendees or 0)
+        sessions = [_entityFromJson(
+                        Session, ndb.Key(Session, data['id'], parent=c_key),
+                        data)
+                    for data in record['sessions']]
+        for session_ in sessions:
+            session_.startDateTime = sessionStart(session_.date,
+                                                  session_.startTime)
+        entities.extend([conf] + shards + sessions)
+        conferences.append(conf)
+        all_sessions.extend(sessions)
+        c_keys.append(c_key)
+
+        # keep the IDs from being allocated again in this environment:
+        allocations.append(Conference.allocate_ids_async(
+            max=c_key.id(), parent=c_key.parent()))
+        if sessions:
+            allocations.append(Session.allocate_ids_async(
+                max=max(data['id'] for data in record['sessions']),
+                parent=c_key))
+
+    # Sessions being overwritten, to take them off their old Speakers:
+    replaced = [old for old in ndb.get_multi(
+                    [session_.key for session_ in all_sessions]) if old]
+    ndb.put_multi(entities)
+    ndb.delete_multi([key for imported_key in c_keys
+                      for key in (speakerIndexKey(imported_key),
+                                  scheduleKey(imported_key))])
+    ndb.Future.wait_all(allocations)
+    indexConferences(conferences)
+    indexSessions(all_sessions)
+    addSpeakerSessions(all_sessions, replaced)
+
+    wscks = [c_key.urlsafe() for c_key in c_keys]
+    memcache.delete_multi([prefix + wsck for wsck in wscks
+                           for prefix in (MEMCACHE_SEATS_KEY,
+                                          MEMCACHE_FEATURED_SPEAKER_KEY)])
+    invalidateMany('conference', wscks)
+    invalidateMany('sessions', wscks)
+
+
+def _exportStep(job):
+    """Write the next batch of Conferences to a part file; returns the
+    job's new progress."""
+
+    token = job.cursor
+    conferences, cursor, more = Conference.query().order(
+        Conference.key).fetch_page(
+            BULK_BATCH_SIZE,
+            start_cursor=Cursor(urlsafe=token) if token else None)
+    if not conferences:
+        return {'done': True}
+
+    session_futures = [Session.query(ancestor=conf.key).fetch_async()
+                       for conf in conferences]
+    # export the exact seat totals (from the shards):
+    seats = getSeatsAvailable(conferences)
+    file_name = '%s/part-%05d.jsonl' % (job.path, job.step)
+    with gcs.open(file_name, 'w', content_type='application/json') as f:
+        for conf, future in zip(conferences, session_futures):
+            conf.seatsAvailable = seats[conf.key]
+            f.write(json.dumps(_conferenceRecord(
+                conf, future.get_result())) + '\n')
+
+    return {
+        'cursor': cursor.urlsafe() if more and cursor else None,
+        'conferences': job.conferences + len(conferences),
+        'done': not (more and cursor),
+    }
+
+
+def _nextFile(path, after=None):
+    """Return the name of the first file under the path prefix after the
+    named one (or the first), or None."""
+
+    for stat in gcs.listbucket(path, marker=after):
+        if not stat.is_dir:
+            return stat.filename
+    return None
+
+
+def _importStep(job):
+    """Store the next batch of Conferences from the job's files; returns
+    the job's new progress."""
+
+    file_name, offset = job.fileName, job.offset
+    if not file_name:
+        file_name, offset = _nextFile(job.path), 0
+        if not file_name:
+            return {'done': True}
+
+    records = []
+    with gcs.open(file_name) as f:
+        f.seek(offset)
+        while len(records) < BULK_BATCH_SIZE:
+            line = f.readline()
+            if not line:
+                break
+            if line.strip():
+                records.append(json.loads(line))
+        offset = f.tell()
+        at_end = not f.readline()
+
+    if records:
+        _putConferenceRecords(records)
+
+    progress = {'conferences': job.conferences + len(records)}
+    if at_end:
+        next_file = _nextFile(job.path, file_name)
+        progress.update(fileName=next_file, offset=0,
+                        done=next_file is None)
+    else:
+        progress.update(fileName=file_name, offset=offset)
+    return progress
+
+
+STEPS = {
+    'export': _exportStep,
+    'import': _importStep,
+}
+
+
+def _enqueueStep(job, transactional=False):
+    """Enqueue the job's current step."""
+
+    taskqueue.add(params={'job': job.key.id(), 'step': job.step},
+                  url=STEP_URLS[job.operation],
+                  transactional=transactional)
+
+
+@ndb.transactional
+def _advance(job_key, step, progress):
+    """Record a finished step and enqueue the next, unless a retry of the
+    step has already done so."""
+
+    job = job_key.get()
+    if job.done or job.step != step:
+        return job
+    job.populate(**progress)
+    job.step += 1
+    job.put()
+    if not job.done:
+        _enqueueStep(job, transactional=True)
+    return job
+
+
+def runStep(job_id, step):
+    """Run a step of a bulk job (from its task)."""
+
+    job = BulkJob.get_by_id(job_id)
+    if not job or job.done or job.step != step:
+        # a duplicate of a finished step
+        return
+    _advance(job.key, step, STEPS[job.operation](job))
+
+
+@ndb.transactional
+def _startJob(job):
+    job.put()
+    _enqueueStep(job, transactional=True)
+    return job
+
+
+def startExport():
+    """Start exporting all Conferences; returns the BulkJob."""
+
+    if gcs is None:
+        raise RuntimeError('The GCS client library is not installed')
+    job_id = BulkJob.allocate_ids(size=1)[0]
+    path = '/%s/conference-export-%d' % (
+        app_identity.get_default_gcs_bucket_name(), job_id)
+    return _startJob(BulkJob(id=job_id, operation='export', path=path))
+
+
+def startImport(path):
+    """Start importing the JSONL files under a GCS path prefix
+    (/bucket/prefix); returns the BulkJob."""
+
+    if gcs is None:
+        raise RuntimeError('The GCS client library is not installed')
+    return _startJob(BulkJob(operation='import', path=path))
+
+
+def resumeJob(job_id):
+    """Re-enqueue the current step of a job whose chain broke off (e.g.
+    after a step ran out of retries); returns the BulkJob, or None."""
+
+    job = BulkJob.get_by_id(job_id)
+    if job and not job.done:
+        _enqueueStep(job)
+    return job
+
+
+def jobStatus(job):
+    """Return the job's progress as a JSON-serializable dict."""
+
+    status = job.to_dict(exclude=['cursor'])
+    status['job'] = job.key.id()
+    for name in ('created', 'updated'):
+        if status[name]:
+            status[name] = status[name].isoformat()
+    return status
@@ -14,30 +14,63 @@ __authors__ = ['wesc+api@google.com (Wesley Chun)',
 
 from datetime import datetime
 from datetime import date as date_
+from datetime import timedelta
+import operator
 
 import endpoints
 from settings import WEB_CLIENT_ID
 from utils import getUserId
+import formcache
+import textsearch
+from instrumentation import instrumentService
+from mailer import queueMail
+from converters import asEnum, asString, asWebsafeKeys, formConverter
+from converters import websafeKey
+from profiles import attendanceKey, attendedConferenceKeys
+from profiles import moveRegistrations, upgradeProfile
+from schedules import SESSION_TO_FORM, loadSchedule, scheduleForms
+from schedules import ScheduleFullError, scheduleKey, sessionStart
+from seats import candidateShardKeys, ensureSeatShards, fillSeatsAvailable
+from seats import getSeatsAvailable, newSeatShards, randomShardKey
+from seats import seatsChanged
+from speakers import MEMCACHE_FEATURED_SPEAKER_KEY
+from speakers import cacheFeaturedSpeaker, deleteSessions, putSessions
+from speakers import speakerKey
 
 from protorpc import messages, message_types, remote
 
 from google.appengine.ext import ndb
+from google.appengine.api import datastore_errors
 from google.appengine.api import memcache
+from google.appengine.api import search
 from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 
 from models import Profile, ProfileMiniForm, ProfileForm
 from models import TeeShirtSize
 from models import Conference, ConferenceForm, ConferenceForms, ConferenceQueryForms
-from models import Session, SessionForm, SessionForms
+from models import Session, SessionForm, SessionForms, SessionQueryForms
+from models import Announcement
+from models import Attendance, AttendeeForm, AttendeeForms
 from models import BooleanMessage
 from models import ConflictException
 from models import StringMessage
 
 MEMCACHE_ANNOUNCEMENTS_KEY = "Recent Announcements"
-MEMCACHE_FEATURED_SPEAKER_KEY = "featured_speaker_"
+CONFIRMATION_SUBJECT = 'You created a new Conference!'
+CONFIRMATION_BODY = 'Hi, you have created a following conference:\r\n\r\n%s'
+NEARLY_SOLD_OUT_SEATS = 5
+MAX_PAGE_SIZE = 100
+# most Conferences one query may read, however many are filtered out
+MAX_QUERY_SCAN = 1000
+QUERY_BATCH_SIZE = 100
+# sessions are written in one transaction, which may hold 500 entities
+MAX_SESSIONS_PER_REQUEST = 400
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 
+ANNOUNCEMENT_KEY = ndb.Key(Announcement, 'nearly_sold_out')
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 DEFAULTS = {
@@ -65,6 +98,15 @@ OPERATORS = {
     'NE':   '!='
 }
 
+COMPARATORS = {
+    '=':    operator.eq,
+    '>':    operator.gt,
+    '>=':   operator.ge,
+    '<':    operator.lt,
+    '<=':   operator.le,
+    '!=':   operator.ne
+}
+
 FIELDS = {
     'CITY': 'city',
     'TOPIC': 'topics',
@@ -72,19 +114,73 @@ FIELDS = {
     'MAX_ATTENDEES': 'maxAttendees'
 }
 
+FIELD_CONVERTERS = {
+    'month':        int,
+    'maxAttendees': int
+}
+
+SESSION_FIELDS = {
+    'DATE': 'date',
+    'START_TIME': 'startTime',
+    'DURATION': 'duration',
+    'TYPE': 'typeOfSession',
+    'SPEAKER': 'speaker',
+    'HIGHLIGHT': 'highlights'
+}
+
+# equality filters querySessions serves along with the start order, each
+# with a composite index on (field, startDateTime) (see index.yaml)
+SESSION_ORDERED_EQUALITIES = ('typeOfSession',)
+
+SESSION_FIELD_CONVERTERS = {
+    'date':         lambda value: datetime.strptime(
+                        value[:10], "%Y-%m-%d").date(),
+    'startTime':    lambda value: datetime.strptime(
+                        value[:5], "%H:%M").time(),
+    'duration':     lambda value: datetime.strptime(
+                        value[:5], "%H:%M").time()
+}
+
 CONF_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
 )
 
+CONF_CONDITIONAL_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    ifNoneMatch=messages.StringField(2),
+)
+
+PROFILE_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    ifNoneMatch=messages.StringField(1),
+)
+
 CONF_POST_REQUEST = endpoints.ResourceContainer(
     ConferenceForm,
     websafeConferenceKey=messages.StringField(1),
 )
 
+CONF_ATTENDEES_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
+)
+
+SEARCH_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    query=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
+)
+
 SESSION_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
-    websafeConferenceKey=messages.StringField(1)
+    websafeConferenceKey=messages.StringField(1),
+    select=messages.StringField(2),
+    ifNoneMatch=messages.StringField(3)
 )
 
 SESSION_GET_REQUEST_BY_TYPE = endpoints.ResourceContainer(
@@ -97,19 +193,52 @@ SESSION_POST_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1)
 )
 
+SESSIONS_POST_REQUEST = endpoints.ResourceContainer(
+    SessionForms,
+    websafeConferenceKey=messages.StringField(1)
+)
+
 SESSION_SPEAKER_REQUEST = endpoints.ResourceContainer(
     speaker = messages.StringField(1)
 )
 
+SESSION_SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
+    speaker = messages.StringField(1),
+    select  = messages.StringField(2)
+)
+
 SESSION_WISH_LIST_POST_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeSessionKey=messages.StringField(1)
 )
 
+SESSION_DELETE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeSessionKey=messages.StringField(1)
+)
+
 WISHLIST_GET_REQUEST_BY_TYPE = endpoints.ResourceContainer(
     typeOfSession=messages.StringField(1)
 )
 
+WISHLIST_GET_REQUEST_BY_DATE = endpoints.ResourceContainer(
+    date=messages.StringField(1)
+)
+
+# entity to form converters; other fields are copied as is
+PROFILE_TO_FORM = formConverter(Profile, ProfileForm, {
+    # convert t-shirt string to Enum
+    'teeShirtSize': asEnum(TeeShirtSize, 'teeShirtSize'),
+    'wishListKeys': asWebsafeKeys('wishListKeys'),
+})
+
+CONFERENCE_TO_FORM = formConverter(Conference, ConferenceForm, {
+    # convert Date to date string
+    'startDate':    asString('startDate'),
+    'endDate':      asString('endDate'),
+    'websafeKey':   websafeKey,
+})
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
@@ -117,6 +246,7 @@ WISHLIST_GET_REQUEST_BY_TYPE = endpoints.ResourceContainer(
                version='v1',
                allowed_client_ids=[WEB_CLIENT_ID, API_EXPLORER_CLIENT_ID],
                scopes=[EMAIL_SCOPE])
+@instrumentService
 class ConferenceApi(remote.Service):
     """Conference API v0.1"""
 
@@ -126,31 +256,47 @@ class ConferenceApi(remote.Service):
 
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name,
-                            getattr(TeeShirtSize,
-                                    getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
-        return pf
+        return PROFILE_TO_FORM(prof)
+
+    # A ConferenceApi instance is created per request, so these memoize the
+    # current user, user id and Profile for the duration of one request:
+    _user = None
+    _user_id = None
+    _profile = None
+
+    def _getUser(self, message="Please Login"):
+        """Return current user, raising UnauthorizedException(message) if
+        not logged in."""
+
+        if not self._user:
+            self._user = endpoints.get_current_user()
+            if not self._user:
+                raise endpoints.UnauthorizedException(message)
+        return self._user
+
+    def _getUserId(self, message="Please Login"):
+        """Return current user's id; looked up once per request."""
+
+        if self._user_id is None:
+            self._user_id = getUserId(self._getUser(message))
+        return self._user_id
 
     def _getProfileFromUser(self):
         """Return user Profile from datastore,
         creating new one if non-existent.
+
+        The Profile is memoized for the request; code that writes a different
+        copy of it must hand that copy to _setProfile().
         """
 
+        if self._profile:
+            return self._profile
+
         # ensure user is logged in:
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException("Please Login")
+        user = self._getUser()
 
         # get Profile entity from datastore by using get() on the key:
-        p_key = ndb.Key(Profile, getUserId(user))
+        p_key = ndb.Key(Profile, self._getUserId())
         profile = p_key.get()
         if not profile:
             profile = Profile(
@@ -161,8 +307,19 @@ class ConferenceApi(remote.Service):
             )
             # save the profile to datastore:
             profile.put()
+        else:
+            # websafe key strings of old Profiles become keys (stored on the
+            # next put)
+            upgradeProfile(profile)
+        self._profile = profile
         return profile
 
+    def _setProfile(self, profile):
+        """Replace the request's memoized Profile with a freshly written
+        copy (e.g. one written in a transaction)."""
+
+        self._profile = profile
+
     def _doProfile(self, save_request=None):
         """Get user Profile and return to user, possibly updating it first."""
 
@@ -171,6 +328,7 @@ class ConferenceApi(remote.Service):
 
         # if saveProfile(), process user-modifyable fields
         if save_request:
+            old_display_name = prof.displayName
             for field in ('displayName', 'teeShirtSize'):
                 if hasattr(save_request, field):
                     val = getattr(save_request, field)
@@ -178,16 +336,25 @@ class ConferenceApi(remote.Service):
                         setattr(prof, field, str(val))
             # put the modified profile to datastore
             prof.put()
+            formcache.bump('profile', prof.key.id())
+            # copy a changed name onto the user's conferences in background
+            if prof.displayName != old_display_name:
+                taskqueue.add(params={'userId': prof.key.id()},
+                              url='/tasks/update_organizer_name')
         # return ProfileForm
         return self._copyProfileToForm(prof)
 
-    @endpoints.method(message_types.VoidMessage, ProfileForm,
+    @endpoints.method(PROFILE_GET_REQUEST, ProfileForm,
                       path='profile',
                       http_method='GET',
                       name='getProfile')
     def getProfile(self, request):
-        """Return user profile."""
-        return self._doProfile()
+        """Return user profile (only notModified if 'ifNoneMatch' is its
+        current etag)."""
+
+        return self._conditionalRead(
+            'profile', self._getUserId('Authorization required'),
+            request.ifNoneMatch, ProfileForm, self._doProfile)
 
     @endpoints.method(ProfileMiniForm, ProfileForm,
                       path='profile',
@@ -201,87 +368,300 @@ class ConferenceApi(remote.Service):
 #         Conference Objects         #
 ######################################
 
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
+    def _formatFilters(self, filters, fields=FIELDS, converters=None):
+        """Parse, check validity and format user supplied filters.
 
-        q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
-
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
-        else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
-
-        for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
-            formatted_query = ndb.query.FilterNode(filtr["field"],
-                                                   filtr["operator"],
-                                                   filtr["value"])
-            q = q.filter(formatted_query)
-        return q
-
-    def _formatFilters(self, filters):
-        """Parse, check validity and format user supplied filters."""
+        fields maps the filterable field names to property names; converters
+        maps property names to functions parsing the filter's value.
+        """
 
         formatted_filters = []
-        inequality_field = None
+        converters = converters or FIELD_CONVERTERS
 
         for f in filters:
             filtr = {field.name:
                      getattr(f, field.name) for field in f.all_fields()}
 
             try:
-                filtr["field"] = FIELDS[filtr["field"]]
+                filtr["field"] = fields[filtr["field"]]
                 filtr["operator"] = OPERATORS[filtr["operator"]]
             except KeyError:
                 raise endpoints.BadRequestException(
                     "Filter contains invalid field or operator.")
 
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in previous
-                # filters; disallow the filter if inequality was performed on a
-                # different field before; track the field on which the
-                # inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
+            if filtr["field"] in converters:
+                try:
+                    filtr["value"] = converters[filtr["field"]](
+                        filtr["value"])
+                except (TypeError, ValueError):
                     raise endpoints.BadRequestException(
-                        "Inequality filter is allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
+                        "Invalid value in filter on %s." % filtr["field"])
 
             formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+        return formatted_filters
+
+    def _planQuery(self, model, filters, order=None):
+        """Pick the filters the datastore can serve from its built-in
+        (single property) indexes, so no composite index is needed. This is
+        a fixed rule, not a cost estimate: all equality filters, else the
+        inequalities on the field with the most bounds.
+
+        Returns (query, residual filters) -- the residual filters are applied
+        in memory to the query's results (see _scanQueryAsync). order is the
+        property to sort on when no filter is served.
+        """
+
+        equalities = [f for f in filters if f["operator"] == "="]
+        inequalities = [f for f in filters if f["operator"] not in ("=", "!=")]
+
+        q = model.query()
+        if equalities:
+            # all equality filters, merge-joined by the datastore; this only
+            # allows ordering by key
+            served = equalities
+        elif inequalities:
+            # the inequalities on one field, preferring a field bounded on
+            # both sides (a range), sorted on that field first
+            bounds = {}
+            for f in inequalities:
+                bounds[f["field"]] = bounds.get(f["field"], 0) + 1
+            field = max((f["field"] for f in inequalities),
+                        key=lambda name: bounds[name])
+            served = [f for f in inequalities if f["field"] == field]
+            q = q.order(model._properties[field])
+        else:
+            served = []
+            if order is not None:
+                q = q.order(order)
+        # break ties on key so cursors are stable; datastore indexes already
+        # end in __key__, so this needs no extra index:
+        q = q.order(model.key)
+
+        for filtr in served:
+            # compare the model's property, so values are stored the way it
+            # stores them (e.g. dates as datetimes):
+            q = q.filter(COMPARATORS[filtr["operator"]](
+                model._properties[filtr["field"]], filtr["value"]))
+        return q, [f for f in filters if f not in served]
+
+    @staticmethod
+    def _sessionStartRange(filters):
+        """Return the [lower, upper) range of startDateTime that Sessions
+        passing the (formatted) date and startTime filters fall in; either
+        bound may be None. startTime filters only narrow it when the date
+        filters leave a single day."""
+
+        lower = upper = None
+        day = timedelta(days=1)
+        for filtr in filters:
+            if filtr["field"] != 'date':
+                continue
+            start = datetime.combine(filtr["value"], datetime.min.time())
+            op = filtr["operator"]
+            bounds = {
+                '=':  (start, start + day),
+                '>':  (start + day, None),
+                '>=': (start, None),
+                '<':  (None, start),
+                '<=': (None, start + day),
+            }.get(op, (None, None))
+            if bounds[0] is not None:
+                lower = bounds[0] if lower is None else max(lower, bounds[0])
+            if bounds[1] is not None:
+                upper = bounds[1] if upper is None else min(upper, bounds[1])
+
+        if lower is not None and upper == lower + day:
+            for filtr in filters:
+                if filtr["field"] != 'startTime':
+                    continue
+                start = datetime.combine(lower.date(), filtr["value"])
+                op = filtr["operator"]
+                if op in ('=', '>', '>='):
+                    lower = max(lower, start)
+                if op in ('=', '<='):
+                    upper = min(upper, start + timedelta(microseconds=1))
+                elif op == '<':
+                    upper = min(upper, start)
+        return lower, upper
+
+    def _planSessionQuery(self, filters, ancestor=None):
+        """Plan a Session query ordered by startDateTime, so results are in
+        date and start time order across pages.
+
+        Serves the date and startTime filters as a range on startDateTime,
+        and the equality filters that have an index in that order
+        (SESSION_ORDERED_EQUALITIES); every served filter only narrows the
+        scan. Returns (query, residual filters); the date and startTime
+        filters stay residual too, as the range may hold a few more Sessions
+        (e.g. ones without a startTime).
+        """
+
+        q = Session.query(ancestor=ancestor)
+        lower, upper = self._sessionStartRange(filters)
+        if lower is not None:
+            q = q.filter(Session.startDateTime >= lower)
+        if upper is not None:
+            q = q.filter(Session.startDateTime < upper)
+        served = [f for f in filters if f["operator"] == "=" and
+                  f["field"] in SESSION_ORDERED_EQUALITIES]
+        for filtr in served:
+            q = q.filter(Session._properties[filtr["field"]] ==
+                         filtr["value"])
+        # break ties on key so cursors are stable
+        q = q.order(Session.startDateTime, Session.key)
+        return q, [f for f in filters if f not in served]
+
+    @staticmethod
+    def _matchesFilters(entity, filters):
+        """Return True if the entity passes all the (formatted) filters,
+        with datastore semantics: a list property passes if any of its values
+        does, and a missing value never passes."""
 
-    def _copyConferenceToForm(self, conf, displayName):
+        for filtr in filters:
+            compare = COMPARATORS[filtr["operator"]]
+            values = getattr(entity, filtr["field"])
+            if not isinstance(values, list):
+                values = [values]
+            if not any(value is not None and compare(value, filtr["value"])
+                       for value in values):
+                return False
+        return True
+
+    @ndb.tasklet
+    def _scanQueryAsync(self, query, residual=(), page_size=None,
+                        page_token=None, projection=None):
+        """Run a query (projected, if projection is given), streaming its
+        results through the residual filters.
+
+        Returns a Future for a (results, next_page_token) tuple. Stops
+        after page_size matches (if given) or after MAX_QUERY_SCAN results;
+        next_page_token is only set if it stopped before the query's end.
+        """
+
+        if page_size is not None:
+            if page_size < 1:
+                raise endpoints.BadRequestException(
+                    "'pageSize' must be a positive number.")
+            page_size = min(page_size, MAX_PAGE_SIZE)
+
+        matches = []
+        scanned = 0
+        more = False
+        try:
+            cursor = Cursor(urlsafe=page_token) if page_token else None
+            results = query.iter(start_cursor=cursor, produce_cursors=True,
+                                 batch_size=QUERY_BATCH_SIZE,
+                                 projection=projection)
+            while (yield results.has_next_async()):
+                if scanned >= MAX_QUERY_SCAN or \
+                        len(matches) == page_size:
+                    more = True
+                    break
+                entity = results.next()
+                scanned += 1
+                if self._matchesFilters(entity, residual):
+                    matches.append(entity)
+        except (datastore_errors.BadValueError,
+                datastore_errors.BadArgumentError,
+                datastore_errors.BadRequestError):
+            if not page_token:
+                raise
+            raise endpoints.BadRequestException(
+                "Invalid 'pageToken' for this query.")
+
+        next_page_token = None
+        if more:
+            next_page_token = results.cursor_after().urlsafe()
+        raise ndb.Return(matches, next_page_token)
+
+    @ndb.tasklet
+    def _getConferencesAsync(self, conf_keys):
+        """Get Conferences by key in a single batch.
+
+        Returns a Future for the list of Conferences; Conferences that no
+        longer exist are dropped.
+        """
+
+        conferences = yield ndb.get_multi_async(conf_keys)
+        raise ndb.Return([conf for conf in conferences if conf])
+
+    def _copyConferencesToForms(self, conferences, next_page_token=None,
+                                select=None):
+        """Copy already fetched Conferences to a ConferenceForms message,
+        filling only the selected fields (all if select is None)."""
+
+        if select is None or 'seatsAvailable' in select:
+            fillSeatsAvailable(conferences)
+        convert = CONFERENCE_TO_FORM.narrow(select)
+        return ConferenceForms(
+            items=[convert(conf) for conf in conferences],
+            nextPageToken=next_page_token
+        )
+
+    def _copyConferenceToForm(self, conf):
         """Copy relevant fields from Conference to ConferenceForm."""
 
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
-        if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
-        return cf
+        return CONFERENCE_TO_FORM(conf)
+
+    def _conditionalRead(self, kind, key, if_none_match, message_type,
+                         read):
+        """Return the form made by read(), with the current version of the
+        kind's forms for the key as its etag; or, if if_none_match is that
+        version already, just a notModified form, without reading anything
+        else."""
+
+        # the version is read first, so it is never newer than the form:
+        # read() builds from data read after it, or returns a form cached
+        # under this version or a later one (the form cache is versioned
+        # the same way, see formcache.py)
+        version = formcache.version(kind, key)
+        if version is None:
+            return read()
+        etag = str(version)
+        if if_none_match == etag:
+            return message_type(etag=etag, notModified=True)
+        form = read()
+        form.etag = etag
+        return form
+
+    def _selectFields(self, select, message_type):
+        """Parse a comma separated 'select' list of form fields; returns a
+        frozenset of the field names, or None (all fields) if empty."""
+
+        if not select:
+            return None
+        names = frozenset(name.strip() for name in select.split(',')
+                          if name.strip())
+        valid = set(field.name for field in message_type.all_fields())
+        for name in names:
+            if name not in valid:
+                raise endpoints.BadRequestException(
+                    "Unknown field in 'select': %s" % name)
+        return names or None
+
+    def _projection(self, model, select, projectable, needed=()):
+        """Return the properties to project to serve the selected fields (plus
+        the needed ones), or None if whole entities must be read.
+
+        projectable are the properties an existing index can project for the
+        query; a projection of anything else would need a new index.
+        """
+
+        if select is None:
+            return None
+        props = set(name for name in select if name in model._properties)
+        props.update(needed)
+        if not props or not props <= set(projectable):
+            return None
+        return sorted(props)
 
     def _createConferenceObject(self, request):
         """Create or update Conference object, returning
         ConferenceForm/request."""
 
         # preload necessary data items
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        user = self._getUser('Authorization required')
+        user_id = self._getUserId()
 
         if not request.name:
             raise endpoints.BadRequestException(
@@ -290,8 +670,8 @@ class ConferenceApi(remote.Service):
         # copy ConferenceForm/ProtoRPC Message into dict
         data = {field.name:
                 getattr(request, field.name) for field in request.all_fields()}
-        del data['websafeKey']
-        del data['organizerDisplayName']
+        for name in ('websafeKey', 'etag', 'notModified'):
+            del data[name]
 
         # add default values for those missing (both data model &
         # outbound Message):
@@ -320,6 +700,11 @@ class ConferenceApi(remote.Service):
 
         # make Profile Key from user ID:
         p_key = ndb.Key(Profile, user_id)
+        # store organizer's name on the Conference, so reads don't need the
+        # Profile (kept current by saveProfile):
+        prof = self._getProfileFromUser()
+        data['organizerDisplayName'] = request.organizerDisplayName = \
+            prof.displayName
         # allocate new Conference ID with Profile key as parent:
         c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
         # make Conference key from ID:
@@ -327,20 +712,22 @@ class ConferenceApi(remote.Service):
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
 
+        # split the seats across counter shards:
+        data['seatShards'], shards = newSeatShards(
+            c_key, data['seatsAvailable'], data['maxAttendees'])
+
         # create Conference & return (modified) ConferenceForm:
-        Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-                              'conferenceInfo': repr(request)},
-                      url='/tasks/send_confirmation_email'
-                      )
+        conf = Conference(**data)
+        ndb.put_multi([conf] + shards)
+        textsearch.indexConferences([conf])
+        queueMail(user.email(),
+                  CONFIRMATION_SUBJECT,
+                  CONFIRMATION_BODY % repr(request))
         return request
 
     @ndb.transactional()
     def _updateConferenceObject(self, request):
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        user_id = self._getUserId('Authorization required')
 
         # copy ConferenceForm/ProtoRPC Message into dict:
         data = {field.name:
@@ -362,6 +749,10 @@ class ConferenceApi(remote.Service):
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
         for field in request.all_fields():
+            # organizer fields and seats are maintained by the server
+            if field.name in ('organizerUserId', 'organizerDisplayName',
+                              'seatsAvailable', 'etag', 'notModified'):
+                continue
             data = getattr(request, field.name)
             # only copy fields where we get data
             if data not in (None, []):
@@ -373,8 +764,7 @@ class ConferenceApi(remote.Service):
                 # write to Conference object
                 setattr(conf, field.name, data)
         conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        return conf
 
     @endpoints.method(ConferenceForm, ConferenceForm,
                       path='conference',
@@ -391,52 +781,71 @@ class ConferenceApi(remote.Service):
                       name='updateConference')
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
-        return self._updateConferenceObject(request)
 
-    @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
+        conf = self._updateConferenceObject(request)
+        formcache.invalidate('conference', conf.key.urlsafe())
+        textsearch.indexConferences([conf])
+        return self._copyConferenceToForm(fillSeatsAvailable([conf])[0])
+
+    @endpoints.method(CONF_CONDITIONAL_GET_REQUEST, ConferenceForm,
                       path='conference/{websafeConferenceKey}',
                       http_method='GET',
                       name='getConference')
     def getConference(self, request):
-        """Return requested conference (by websafeConferenceKey)."""
-
-        # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        if not conf:
-            raise endpoints.NotFoundException(
-                'No conference found with key: %s'
-                % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
-        # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        """Return requested conference (by websafeConferenceKey); only
+        notModified if 'ifNoneMatch' is its current etag."""
+
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+
+        def build():
+            # get Conference object from request; bail if not found
+            conf = c_key.get()
+            if not conf:
+                raise endpoints.NotFoundException(
+                    'No conference found with key: %s'
+                    % request.websafeConferenceKey)
+            return self._copyConferenceToForm(fillSeatsAvailable([conf])[0])
+
+        # return ConferenceForm, from memcache if cached
+        return self._conditionalRead(
+            'conference', c_key.urlsafe(), request.ifNoneMatch,
+            ConferenceForm,
+            lambda: formcache.readThrough('conference', c_key.urlsafe(),
+                                          ConferenceForm, build))
 
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
                       path='queryConferences',
                       http_method='POST',
                       name='queryConferences')
     def queryConferences(self, request):
-        """Query for conferences."""
+        """Query for conferences; paged by cursor if 'pageSize' is given.
 
-        conferences = self._getQuery(request)
-
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [
-            (ndb.Key(Profile, conf.organizerUserId)) for conf in conferences
-            ]
-        profiles = ndb.get_multi(organisers)
+        Any combination of filters is allowed. Results are sorted by name
+        within each page. Unfiltered queries are in name order across pages
+        too; filtered ones page in the order of the filters the datastore
+        serves (see _planQuery): the inequality field, or no particular
+        order (key order) when there are equality filters.
+        """
 
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        # run the planned query once, filtering out what the datastore
+        # doesn't; organizer names are stored on the Conferences
+        filters = self._formatFilters(request.filters)
+        query, residual = self._planQuery(Conference, filters,
+                                          order=Conference.name)
+        select = self._selectFields(request.select, ConferenceForm)
+        # unfiltered queries are served by the name index, which can also
+        # project the name (needed for sorting)
+        projection = self._projection(Conference, select,
+                                      [] if filters else ['name'],
+                                      needed=['name'])
+        conferences, next_page_token = self._scanQueryAsync(
+            query, residual, request.pageSize, request.pageToken,
+            projection).get_result()
+        conferences.sort(key=lambda conf: conf.name)
 
         # return individual ConferenceForm object per Conference
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(
-                conf,
-                names[conf.organizerUserId]) for conf in conferences]
-        )
+        return self._copyConferencesToForms(conferences, next_page_token,
+                                            select)
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
                       path='queryConferencesCreated',
@@ -445,22 +854,44 @@ class ConferenceApi(remote.Service):
     def queryConferencesCreated(self, request):
         """Return conferences created by CURRENT user."""
 
-        # ensure user is logged in:
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException("Please Login")
+        # ensure user is logged in; create ancestor query for all key
+        # matches for this user
+        p_key = ndb.Key(Profile, self._getUserId())
+        conferences = Conference.query(ancestor=p_key).fetch()
 
-        # create ancestor query for all key matches for this user
-        p_key = ndb.Key(Profile, getUserId(user))
-        conferences = Conference.query(ancestor=p_key)
-        profile = p_key.get()
-        display_name = profile.displayName
+        return self._copyConferencesToForms(conferences)
 
-        return ConferenceForms(
-            items=[
-                self._copyConferenceToForm(x, display_name)
-                for x in conferences]
-        )
+    def _search(self, search_func, request):
+        """Run a full-text search for the request's query; returns
+        (keys, next_page_token) of the best matches."""
+
+        if not request.query:
+            raise endpoints.BadRequestException("'query' field required")
+        if request.pageSize is not None and request.pageSize < 1:
+            raise endpoints.BadRequestException(
+                "'pageSize' must be a positive number.")
+        try:
+            return search_func(request.query, request.pageSize,
+                               request.pageToken)
+        except search.QueryError:
+            raise endpoints.BadRequestException(
+                "Invalid search query: %s" % request.query)
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "Invalid 'pageToken' for this query.")
+
+    @endpoints.method(SEARCH_REQUEST, ConferenceForms,
+                      path='conferences/search',
+                      http_method='GET',
+                      name='searchConferences')
+    def searchConferences(self, request):
+        """Search conferences by words in their name, description or
+        topics; best matches first, paged by 'pageToken'."""
+
+        c_keys, next_page_token = self._search(
+            textsearch.searchConferences, request)
+        conferences = self._getConferencesAsync(c_keys).get_result()
+        return self._copyConferencesToForms(conferences, next_page_token)
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
                       path='filterPlayground',
@@ -475,15 +906,59 @@ class ConferenceApi(remote.Service):
             Conference.topics == "Medical Innovations")
         query_object = query_object.filter(Conference.seatsAvailable > 23)
 
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(x, "") for x in query_object]
-        )
+        return self._copyConferencesToForms(query_object.fetch())
 
 ######################################
 #            Registration            #
 ######################################
 
     @ndb.transactional(xg=True)
+    def _registerOnShard(self, p_key, shard_key, c_key, reg=True):
+        """Register user (creating their Attendance), taking a seat from the
+        given seat shard, or unregister, giving a seat back to it. Returns the
+        user's Profile, or None if nothing changed (shard is empty / user was
+        not registered).
+        """
+
+        a_key = attendanceKey(p_key, c_key)
+        prof, attendance = ndb.get_multi([p_key, a_key])
+        shard = shard_key.get() if shard_key else None
+        # registrations still listed on the Profile move to Attendances
+        moved = dict((a.key, a) for a in moveRegistrations(prof))
+        attendance = attendance or moved.get(a_key)
+        written = [prof] + moved.values() if moved else []
+
+        # register
+        if reg:
+            # check if user already registered otherwise add
+            if attendance:
+                raise ConflictException(
+                    "You have already registered for this conference")
+
+            # check if seats avail in this shard
+            if not shard or shard.seatsAvailable <= 0:
+                return None
+
+            # register user, take away one seat
+            written.append(Attendance(key=a_key, conference=c_key))
+            shard.seatsAvailable -= 1
+
+        # unregister
+        else:
+            # check if user already registered
+            if not attendance:
+                return None
+
+            # unregister user, add back one seat
+            written = [entity for entity in written if entity.key != a_key]
+            ndb.delete_multi([a_key])
+            if shard:
+                shard.seatsAvailable += 1
+
+        # write things back to the datastore
+        ndb.put_multi(written + [shard] if shard else written)
+        return prof
+
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
 
@@ -498,38 +973,44 @@ class ConferenceApi(remote.Service):
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
 
+        # split seats of conferences created before seat sharding
+        if not conf.seatShards:
+            conf = ensureSeatShards(conf.key)
+
         # register
         if reg:
-            # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
+            # check if user already registered (checked again, atomically,
+            # when taking the seat)
+            if conf.key in prof.conferenceKeysToAttend or \
+                    attendanceKey(prof.key, conf.key).get():
                 raise ConflictException(
                     "You have already registered for this conference")
 
+            # take a seat from the first shard that still has one
+            written = None
+            for shard_key in candidateShardKeys(conf):
+                written = self._registerOnShard(prof.key, shard_key,
+                                                conf.key)
+                if written:
+                    break
+
             # check if seats avail
-            if conf.seatsAvailable <= 0:
+            if not written:
                 raise ConflictException(
                     "There are no seats available.")
 
-            # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
-            retval = True
-
         # unregister
         else:
-            # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
-
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
-            else:
-                retval = False
-
-        # write things back to the datastore & return
-        prof.put()
-        conf.put()
+            written = self._registerOnShard(
+                prof.key, randomShardKey(conf), conf.key, reg=False)
+
+        retval = bool(written)
+        if written:
+            self._setProfile(written)
+            formcache.invalidate('conference', conf.key.urlsafe())
+            delta = -1 if reg else 1
+            self._seatsChangedAnnouncement(
+                conf, seatsChanged(conf, delta), delta)
         return BooleanMessage(data=retval)
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
@@ -551,27 +1032,48 @@ class ConferenceApi(remote.Service):
         # get user profile
         prof = self._getProfileFromUser()
 
-        # get conferenceKeysToAttend from profile.
-        array_conf_keys = [ndb.Key(urlsafe=wsck)
-                           for wsck in prof.conferenceKeysToAttend]
-
-        # fetch conferences from datastore:
-        conferences = ndb.get_multi(array_conf_keys)
-
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId)
-                      for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        # fetch conferences (from the user's Attendances) in one batch:
+        conferences = self._getConferencesAsync(
+            attendedConferenceKeys(prof)).get_result()
 
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(
-                conf, names[conf.organizerUserId]) for conf in conferences]
+        return self._copyConferencesToForms(conferences)
+
+    @endpoints.method(CONF_ATTENDEES_REQUEST, AttendeeForms,
+                      path='conference/{websafeConferenceKey}/attendees',
+                      http_method='GET',
+                      name='getConferenceAttendees')
+    def getConferenceAttendees(self, request):
+        """Get the users registered for a conference, paged by cursor --
+        open to the organizer of the conference."""
+
+        conf = self._getOwnConference(
+            request.websafeConferenceKey,
+            "Only the creator of the conference may list its attendees.")
+
+        # Attendances by conference, from the built-in index:
+        query = Attendance.query(Attendance.conference == conf.key).order(
+            Attendance.key)
+        page_size = min(request.pageSize or MAX_PAGE_SIZE, MAX_PAGE_SIZE)
+        try:
+            cursor = (Cursor(urlsafe=request.pageToken)
+                      if request.pageToken else None)
+            a_keys, next_cursor, more = query.fetch_page(
+                page_size, start_cursor=cursor, keys_only=True)
+        except (datastore_errors.BadValueError,
+                datastore_errors.BadArgumentError,
+                datastore_errors.BadRequestError):
+            raise endpoints.BadRequestException(
+                "Invalid 'pageToken' for this query.")
+
+        # get the attendees' profiles in one batch:
+        profiles = ndb.get_multi([a_key.parent() for a_key in a_keys])
+        return AttendeeForms(
+            items=[AttendeeForm(userId=prof.key.id(),
+                                displayName=prof.displayName)
+                   for prof in profiles if prof],
+            nextPageToken=(next_cursor.urlsafe()
+                           if more and next_cursor else None)
         )
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
@@ -588,31 +1090,89 @@ class ConferenceApi(remote.Service):
 #           Announcements            #
 ######################################
 
+    @staticmethod
+    def _isNearlySoldOut(seats_available):
+        """Return whether a conference with these seats left is announced."""
+        return 0 < seats_available <= NEARLY_SOLD_OUT_SEATS
+
+    @staticmethod
+    def _formatAnnouncement(nearly_sold_out):
+        """Format the announcement for the {websafeKey: name} nearly sold
+        out conferences ("" if there are none)."""
+
+        if not nearly_sold_out:
+            return ""
+        return '%s %s' % (
+            'Last chance to attend! The following conferences '
+            'are nearly sold out:',
+            ', '.join(sorted(nearly_sold_out.values())))
+
+    @staticmethod
+    @ndb.transactional
+    def _updateNearlySoldOut(add=None, remove=(), replace=None):
+        """Update the stored set of nearly sold out conferences: add a
+        {websafeKey: name} dict, remove websafeKeys, or replace it all."""
+
+        ann = ANNOUNCEMENT_KEY.get() or Announcement(key=ANNOUNCEMENT_KEY)
+        nearly_sold_out = dict(ann.nearlySoldOut or {})
+        if replace is not None:
+            nearly_sold_out = replace
+        nearly_sold_out.update(add or {})
+        for wsck in remove:
+            nearly_sold_out.pop(wsck, None)
+        if nearly_sold_out != ann.nearlySoldOut:
+            ann.nearlySoldOut = nearly_sold_out
+            ann.put()
+        return nearly_sold_out
+
+    @staticmethod
+    def _seatsChangedAnnouncement(conf, seats_available, delta):
+        """Called on every seat change; updates the nearly sold out set (and
+        drops the cached announcement) only when the conference crosses the
+        NEARLY_SOLD_OUT_SEATS threshold."""
+
+        was_near = ConferenceApi._isNearlySoldOut(seats_available - delta)
+        is_near = ConferenceApi._isNearlySoldOut(seats_available)
+        if was_near == is_near:
+            return
+
+        wsck = conf.key.urlsafe()
+        if is_near:
+            ConferenceApi._updateNearlySoldOut(add={wsck: conf.name})
+        else:
+            ConferenceApi._updateNearlySoldOut(remove=[wsck])
+        memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+
     @staticmethod
     def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
+        """Reconcile the nearly sold out set & assign Announcement to
+        memcache; used by memcache cron job.
+
+        Registration keeps the set current; this only fixes drift (e.g.
+        conferences from before it was maintained), checking the candidates
+        against their exact seat counts.
         """
 
+        # candidates: conferences whose seatsAvailable snapshot is low, plus
+        # the current set
         confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
+            Conference.seatsAvailable <= NEARLY_SOLD_OUT_SEATS,
             Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
-
-        if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = '%s %s' % (
-                'Last chance to attend! The following conferences '
-                'are nearly sold out:',
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
-
+        ).fetch(keys_only=True)
+        ann = ANNOUNCEMENT_KEY.get()
+        if ann and ann.nearlySoldOut:
+            confs.extend(ndb.Key(urlsafe=wsck) for wsck in ann.nearlySoldOut)
+        confs = [conf for conf in ndb.get_multi(list(set(confs))) if conf]
+
+        seats_available = getSeatsAvailable(confs)
+        nearly_sold_out = ConferenceApi._updateNearlySoldOut(replace={
+            conf.key.urlsafe(): conf.name for conf in confs
+            if ConferenceApi._isNearlySoldOut(seats_available[conf.key])})
+
+        # format announcement and set it in memcache ("" if there are no
+        # nearly sold out conferences)
+        announcement = ConferenceApi._formatAnnouncement(nearly_sold_out)
+        memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
         return announcement
 
     @endpoints.method(message_types.VoidMessage, StringMessage,
@@ -622,10 +1182,14 @@ class ConferenceApi(remote.Service):
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""
 
-        # return an existing announcement from Memcache or an empty string.
+        # return an existing announcement from Memcache; rebuild it from the
+        # nearly sold out set if it's not there.
         announcement = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY)
-        if not announcement:
-            announcement = ""
+        if announcement is None:
+            ann = ANNOUNCEMENT_KEY.get()
+            announcement = self._formatAnnouncement(
+                ann.nearlySoldOut if ann else None)
+            memcache.add(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
         return StringMessage(data=announcement)
 
 ######################################
@@ -635,55 +1199,34 @@ class ConferenceApi(remote.Service):
     def _copySessionToForm(self, session_):
         """Copy fields from Session to SessionForm"""
 
-        sf = SessionForm()
-        for field in sf.all_fields():
-            if hasattr(session_, field.name):
-                # convert date, time, and duration to string:
-                if field.name == "date" or field.name == "startTime" or \
-                        field.name == "duration":
-                    setattr(sf, field.name, str(getattr(session_, field.name)))
-                # all other fields are simply copied:
-                else:
-                    setattr(sf, field.name, getattr(session_, field.name))
-            elif field.name == "websafeKey":
-                setattr(sf, field.name, session_.key.urlsafe())
-            elif field.name == "websafeConferenceKey":
-                setattr(sf, field.name, session_.key.parent().urlsafe())
-
-        sf.check_initialized()
-        return sf
-
-    def _query_sessions(self, request):
-        """Helper function for getting sessions"""
-
-        # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        if not conf:
-            raise endpoints.NotFoundException(
-                'No conference found with key: %s'
-                % request.websafeConferenceKey)
-
-        # find sessions:
-        sessions_ = Session.query(ancestor=conf.key)
-
-        return sessions_
-
-    def _createSessionObject(self, request):
-        """Helper function to create session object and check featured speaker.
-
-        Creates session object, returning SessionForm object. Also initiates a
-        taskqueue to check for featured speaker.
-        """
+        return SESSION_TO_FORM(session_)
+
+    def _getSchedule(self, request):
+        """Helper function for getting the conference's Schedule (its
+        sessions, see schedules.py)"""
+
+        # one key read; the conference itself is only read if the schedule
+        # isn't there (yet)
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        schedule = scheduleKey(c_key).get()
+        if not schedule:
+            # bail if Conference not found
+            if not c_key.get():
+                raise endpoints.NotFoundException(
+                    'No conference found with key: %s'
+                    % request.websafeConferenceKey)
+            schedule = loadSchedule(c_key)
+        return schedule
+
+    def _getOwnConference(self, wsck, message):
+        """Return the Conference (by websafe key) if the user organizes it;
+        raise otherwise."""
 
         # ensure user is logged in:
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException("Authorization required")
-        user_id = getUserId(user)
+        user_id = self._getUserId("Authorization required")
 
         # check if conf exists given websafeConfKey
         # get conference; check that it exists
-        wsck = request.websafeConferenceKey
         conf = ndb.Key(urlsafe=wsck).get()
         if not conf:
             raise endpoints.NotFoundException(
@@ -691,26 +1234,30 @@ class ConferenceApi(remote.Service):
 
         # check to make sure user is also the creator of object:
         if user_id != conf.organizerUserId:
-            raise endpoints.UnauthorizedException(
-                "Only the creator of the conference may add sessions.")
+            raise endpoints.UnauthorizedException(message)
+        return conf
+
+    def _sessionDataFromForm(self, form):
+        """Copy SessionForm into a hash of Session fields, with defaults for
+        those missing (on both data model & outbound Message)."""
 
         # ensure session's name was specified:
-        if not request.name:
+        if not form.name:
             raise endpoints.BadRequestException(
                 "Session 'name' field required")
 
         # copy SessionForm/ProtoRPC Message into hash:
-        data = {field.name: getattr(request, field.name)
-                for field in request.all_fields()}
+        data = {field.name: getattr(form, field.name)
+                for field in form.all_fields()}
         del data['websafeKey']
-        del data['websafeConferenceKey']
+        data.pop('websafeConferenceKey', None)
 
         # add default values for those missing (both data model & outbound
         # Message):
         for df in DEFAULTS_SESSION:
             if data[df] in (None, []):
                 data[df] = DEFAULTS_SESSION[df]
-                setattr(request, df, DEFAULTS_SESSION[df])
+                setattr(form, df, DEFAULTS_SESSION[df])
 
         # convert date from string to Date object:
         if data['date']:
@@ -724,25 +1271,51 @@ class ConferenceApi(remote.Service):
         if data['duration']:
             data['duration'] = datetime.strptime(
                 data['duration'][:10], "%H:%M").time()
+        # combined, to order queries by:
+        data['startDateTime'] = sessionStart(data['date'], data['startTime'])
+        return data
+
+    def _createSessionObjects(self, wsck, forms):
+        """Helper function to create session objects and check featured
+        speaker.
+
+        Creates the sessions in one transaction (together with the
+        conference's updated speaker index), returning the Sessions. Also
+        updates the featured speaker from the index.
+        """
+
+        conf = self._getOwnConference(
+            wsck, "Only the creator of the conference may add sessions.")
+        # convert (and validate) all forms before writing any session:
+        session_data = [self._sessionDataFromForm(form) for form in forms]
 
         # make Conference key:
         c_key = conf.key
-        # allocate new Session ID with Conference key as parent:
-        s_id = Session.allocate_ids(size=1, parent=c_key)[0]
-        # make Session key from ID:
-        s_key = ndb.Key(Session, s_id, parent=c_key)
-        data['key'] = s_key
-        # create Session:
-        Session(**data).put()
+        # allocate new Session IDs with Conference key as parent:
+        first, last = Session.allocate_ids(size=len(session_data),
+                                           parent=c_key)
+        # create Sessions with keys from the IDs, along with the updated
+        # speaker index:
+        sessions_ = [Session(key=ndb.Key(Session, s_id, parent=c_key), **data)
+                     for s_id, data in zip(range(first, last + 1),
+                                           session_data)]
+        try:
+            index = putSessions(c_key, sessions_)
+        except ScheduleFullError as e:
+            raise endpoints.BadRequestException(str(e))
+        textsearch.indexSessions(sessions_)
 
         # check for featured speaker in conference:
-        taskqueue.add(params={'speaker': data['speaker'],
-                              'wsck': wsck
-                              },
-                      url='/tasks/set_featured_speaker')
+        cacheFeaturedSpeaker(c_key, index)
+        formcache.invalidate('sessions', c_key.urlsafe())
+        return sessions_
+
+    def _createSessionObject(self, request):
+        """Create session object, returning SessionForm object."""
 
+        session_ = self._createSessionObjects(
+            request.websafeConferenceKey, [request])[0]
         # return (modified) SessionForm ('models.SessionForm'):
-        session_ = s_key.get()
         return self._copySessionToForm(session_)
 
     @endpoints.method(SESSION_POST_REQUEST, SessionForm,
@@ -754,20 +1327,79 @@ class ConferenceApi(remote.Service):
 
         return self._createSessionObject(request)
 
+    @endpoints.method(SESSIONS_POST_REQUEST, SessionForms,
+                      path='conference/{websafeConferenceKey}/sessions/new',
+                      http_method="POST",
+                      name="createSessions")
+    def createSessions(self, request):
+        """Create several sessions at once (e.g. a whole agenda) -- open to
+        the organizer of the conference"""
+
+        if not request.items:
+            raise endpoints.BadRequestException(
+                "At least one session required")
+        if len(request.items) > MAX_SESSIONS_PER_REQUEST:
+            raise endpoints.BadRequestException(
+                "At most %d sessions may be created at once"
+                % MAX_SESSIONS_PER_REQUEST)
+
+        sessions_ = self._createSessionObjects(
+            request.websafeConferenceKey, request.items)
+        return SessionForms(
+            items=[self._copySessionToForm(x) for x in sessions_])
+
+    @endpoints.method(SESSION_DELETE_REQUEST, BooleanMessage,
+                      path='session/{websafeSessionKey}',
+                      http_method='DELETE',
+                      name='deleteSession')
+    def deleteSession(self, request):
+        """Delete session -- open to the organizer of the conference"""
+
+        # ensure user is logged in:
+        user_id = self._getUserId("Authorization required")
+
+        # get session and its conference; check that they exist
+        wssk = request.websafeSessionKey
+        s_key = ndb.Key(urlsafe=wssk)
+        session_, conf = ndb.get_multi([s_key, s_key.parent()])
+        if not session_ or not conf:
+            raise endpoints.NotFoundException(
+                'No session found with key: %s' % wssk)
+
+        # check to make sure user is also the creator of conference:
+        if user_id != conf.organizerUserId:
+            raise endpoints.UnauthorizedException(
+                "Only the creator of the conference may delete sessions.")
+
+        # delete Session, along with the updated speaker index:
+        index = deleteSessions(conf.key, [s_key])
+        textsearch.unindexSessions([s_key])
+        cacheFeaturedSpeaker(conf.key, index)
+        formcache.invalidate('sessions', conf.key.urlsafe())
+        return BooleanMessage(data=True)
+
     @endpoints.method(SESSION_GET_REQUEST, SessionForms,
                       path='conference/{websafeConferenceKey}/sessions',
                       http_method='GET',
                       name='getConferenceSessions')
     def getConferenceSessions(self, request):
-        """Return sessions given the conference (by websafeConferenceKey)."""
+        """Return sessions given the conference (by websafeConferenceKey);
+        only notModified if 'ifNoneMatch' is their current etag."""
 
-        # find sessions:
-        sessions_ = self._query_sessions(request)
+        select = self._selectFields(request.select, SessionForm)
 
-        # return an array of individual sessions-form objects per conference:
-        return SessionForms(
-            items=[self._copySessionToForm(x) for x in sessions_]
-        )
+        def build():
+            # return the conference's sessions-form objects, by date and
+            # start time, from its schedule:
+            return scheduleForms(self._getSchedule(request), select=select)
+
+        wsck = ndb.Key(urlsafe=request.websafeConferenceKey).urlsafe()
+        return self._conditionalRead(
+            'sessions', wsck, request.ifNoneMatch, SessionForms,
+            lambda: formcache.readThrough(
+                'sessions', wsck, SessionForms, build,
+                variant=('select:%s' % ','.join(sorted(select))
+                         if select else '')))
 
     @endpoints.method(SESSION_GET_REQUEST_BY_TYPE, SessionForms,
                       path='conference/{websafeConferenceKey}/sessions/type',
@@ -778,20 +1410,41 @@ class ConferenceApi(remote.Service):
         specified type (e.g. lecture, keynote, workshop).
         """
 
-        # find sessions:
-        sessions_ = self._query_sessions(request)
-
-        # filter results:
-        sessions_ = sessions_.filter(
-            Session.typeOfSession == request.typeOfSession
-        )
-
-        # return an array of individual sessions-form objects per conference:
-        return SessionForms(
-            items=[self._copySessionToForm(x) for x in sessions_]
-        )
+        def build():
+            # return the sessions-form objects of the type, by date and
+            # start time, from the conference's schedule:
+            return scheduleForms(self._getSchedule(request),
+                                 type_of_session=request.typeOfSession or '')
+
+        return formcache.readThrough(
+            'sessions',
+            ndb.Key(urlsafe=request.websafeConferenceKey).urlsafe(),
+            SessionForms, build,
+            variant='type:%s' % (request.typeOfSession or ''))
+
+    @ndb.tasklet
+    def _getSpeakerSessionsAsync(self, speaker, session_keys=None):
+        """Get the Sessions given by the speaker (any spelling of the name
+        with the same normalized identity), optionally only those among
+        session_keys.
+
+        Returns a Future for the list of Sessions; Sessions that no longer
+        exist are dropped.
+        """
 
-    @endpoints.method(SESSION_SPEAKER_REQUEST, SessionForms,
+        s_key = speakerKey(speaker)
+        speaker_ = (yield s_key.get_async()) if s_key else None
+        if not speaker_:
+            raise ndb.Return([])
+        keys = speaker_.sessionKeys
+        if session_keys is not None:
+            # (in the order of session_keys)
+            speaker_keys = set(keys)
+            keys = [k for k in session_keys if k in speaker_keys]
+        sessions_ = yield ndb.get_multi_async(keys)
+        raise ndb.Return([x for x in sessions_ if x])
+
+    @endpoints.method(SESSION_SPEAKER_GET_REQUEST, SessionForms,
                       path='sessions/speaker',
                       http_method='GET',
                       name='getSessionsBySpeaker')
@@ -800,21 +1453,87 @@ class ConferenceApi(remote.Service):
         speaker, across all conferences.
         """
 
-        # find sessions:
-        sessions_ = Session.query(Session.speaker == request.speaker)
+        select = self._selectFields(request.select, SessionForm)
+        convert = SESSION_TO_FORM.narrow(select)
+
+        # find sessions, from the speaker's list of them:
+        sessions_ = self._getSpeakerSessionsAsync(
+            request.speaker).get_result()
 
         # order alphabetically:
-        sessions_ = sessions_.order(Session.name)
+        sessions_.sort(key=lambda x: x.name)
 
         # return an array of sessions-form objects:
         return SessionForms(
-            items=[self._copySessionToForm(x) for x in sessions_]
+            items=[convert(x) for x in sessions_]
+        )
+
+    @endpoints.method(SessionQueryForms, SessionForms,
+                      path='querySessions',
+                      http_method='POST',
+                      name='querySessions')
+    def querySessions(self, request):
+        """Query for sessions (of a conference, if websafeConferenceKey is
+        given); paged by cursor if 'pageSize' is given.
+
+        Any combination of filters is allowed. Results are sorted by date and
+        start time, across pages too.
+        """
+
+        filters = self._formatFilters(request.filters, SESSION_FIELDS,
+                                      SESSION_FIELD_CONVERTERS)
+        ancestor = None
+        if request.websafeConferenceKey:
+            ancestor = ndb.Key(urlsafe=request.websafeConferenceKey)
+
+        # run the planned query once, filtering out what the datastore
+        # doesn't
+        query, residual = self._planSessionQuery(filters, ancestor)
+        sessions_, next_page_token = self._scanQueryAsync(
+            query, residual, request.pageSize,
+            request.pageToken).get_result()
+
+        return SessionForms(
+            items=[self._copySessionToForm(x) for x in sessions_],
+            nextPageToken=next_page_token
+        )
+
+    @endpoints.method(SEARCH_REQUEST, SessionForms,
+                      path='sessions/search',
+                      http_method='GET',
+                      name='searchSessions')
+    def searchSessions(self, request):
+        """Search sessions by words in their name, highlights or speaker;
+        best matches first, paged by 'pageToken'."""
+
+        s_keys, next_page_token = self._search(
+            textsearch.searchSessions, request)
+        sessions_ = ndb.get_multi(s_keys)
+        return SessionForms(
+            items=[self._copySessionToForm(x) for x in sessions_ if x],
+            nextPageToken=next_page_token
         )
 
 ######################################
 #               Wishlist             #
 ######################################
 
+    @ndb.tasklet
+    def _getWishlistSessionsAsync(self, profile_, conference_key=None):
+        """Get the Sessions in the profile's wishlist in a single batch,
+        optionally only those of the given Conference.
+
+        Returns a Future for the list of Sessions; Sessions that no longer
+        exist are dropped.
+        """
+
+        session_keys = profile_.wishListKeys
+        if conference_key:
+            session_keys = [s_key for s_key in session_keys
+                            if s_key.parent() == conference_key]
+        sessions_ = yield ndb.get_multi_async(session_keys)
+        raise ndb.Return([x for x in sessions_ if x])
+
     @endpoints.method(SESSION_WISH_LIST_POST_REQUEST, BooleanMessage,
                       path='addToWishlist',
                       http_method='POST',
@@ -825,12 +1544,15 @@ class ConferenceApi(remote.Service):
 
         retval = None
 
+        # get session by websafe key, while getting the profile:
+        wsck = request.websafeSessionKey
+        s_key = ndb.Key(urlsafe=wsck)
+        session_future = s_key.get_async()
+
         # ensure user is logged in, and get profile:
         profile_ = self._getProfileFromUser()
 
-        # get session by websafe key:
-        wsck = request.websafeSessionKey
-        session_ = ndb.Key(urlsafe=wsck).get()
+        session_ = session_future.get_result()
         # check if session exists:
         if not session_:
             raise endpoints.NotFoundException(
@@ -838,16 +1560,16 @@ class ConferenceApi(remote.Service):
 
         # register:
         # check if user already added to wishlist; otherwise add:
-        if wsck in profile_.wishListKeys:
+        if s_key in profile_.wishListKeys:
             raise ConflictException(
                 "You have already have this session in your wishlist")
         else:
-            profile_.wishListKeys.append(wsck)
+            profile_.wishListKeys.append(s_key)
             retval = True
 
-        # write things back to the datastore & return
+        # write profile back to the datastore (session is unchanged) & return
         profile_.put()
-        session_.put()
+        formcache.bump('profile', profile_.key.id())
         return BooleanMessage(data=retval)
 
     @endpoints.method(message_types.VoidMessage, SessionForms,
@@ -861,12 +1583,9 @@ class ConferenceApi(remote.Service):
         # ensure user is logged in, and get profile:
         profile_ = self._getProfileFromUser()
 
-        # get wishListKeys (array of session keys) from profile:
-        session_keys = [ndb.Key(urlsafe=wsck)
-                        for wsck in profile_.wishListKeys]
-
-        # fetch sessions from datastore:
-        wish_list_sessions = ndb.get_multi(session_keys)
+        # fetch sessions in wishlist:
+        wish_list_sessions = self._getWishlistSessionsAsync(
+            profile_).get_result()
 
         # return set of SessionForm objects per Session:
         return SessionForms(
@@ -877,34 +1596,40 @@ class ConferenceApi(remote.Service):
 #         Additional Queries         #
 ######################################
 
-    @endpoints.method(WISHLIST_GET_REQUEST_BY_TYPE, SessionForms,
-                      path='wishlist/type',
-                      http_method='GET',
-                      name='getSessionsInWishlistByType')
-    def getSessionsInWishlistByType(self, request):
-        """Return user's wishlist, filtered by session type."""
+    def _filterWishlist(self, conference_key=None, **criteria):
+        """Return user's wishlist Sessions (as SessionForms) whose properties
+        equal the given criteria.
+
+        Filtering is done in memory on the wishlist itself, so the cost only
+        depends on the length of the wishlist. If conference_key is given,
+        only that Conference's Sessions are fetched at all.
+        """
 
         # ensure user is logged in, and get profile:
         profile_ = self._getProfileFromUser()
 
-        # get wishListKeys (array of session keys) from profile:
-        session_keys = [ndb.Key(urlsafe=wsck)
-                        for wsck in profile_.wishListKeys]
-
         # fetch sessions in wishlist:
-        wish_list_sessions = ndb.get_multi(session_keys)
+        wish_list_sessions = self._getWishlistSessionsAsync(
+            profile_, conference_key).get_result()
 
-        # query ALL sessions (not just ones in wishlist), filtered by type:
-        requested_session_type = Session.query(
-            Session.typeOfSession == request.typeOfSession)
-
-        # If any of the user's wishlist session matches the session query,
-        # append this session to result. Return result as SessionForms object:
+        # keep the sessions matching every criterion. Return result as
+        # SessionForms object:
+        criteria = criteria.items()
         return SessionForms(
             items=[self._copySessionToForm(x) for x in wish_list_sessions
-                   if x in requested_session_type]
+                   if all(getattr(x, name) == value
+                          for name, value in criteria)]
         )
 
+    @endpoints.method(WISHLIST_GET_REQUEST_BY_TYPE, SessionForms,
+                      path='wishlist/type',
+                      http_method='GET',
+                      name='getSessionsInWishlistByType')
+    def getSessionsInWishlistByType(self, request):
+        """Return user's wishlist, filtered by session type."""
+
+        return self._filterWishlist(typeOfSession=request.typeOfSession)
+
     @endpoints.method(SESSION_SPEAKER_REQUEST, SessionForms,
                       path='wishlist/speaker',
                       http_method='GET',
@@ -915,23 +1640,36 @@ class ConferenceApi(remote.Service):
         # ensure user is logged in, and get profile:
         profile_ = self._getProfileFromUser()
 
-        # get wishListKeys (array of session keys) from profile:
-        session_keys = [ndb.Key(urlsafe=wsck)
-                        for wsck in profile_.wishListKeys]
+        # fetch only the wishlisted sessions the speaker gives:
+        sessions_ = self._getSpeakerSessionsAsync(
+            request.speaker, profile_.wishListKeys).get_result()
+        return SessionForms(
+            items=[self._copySessionToForm(x) for x in sessions_]
+        )
+
+    @endpoints.method(WISHLIST_GET_REQUEST_BY_DATE, SessionForms,
+                      path='wishlist/date',
+                      http_method='GET',
+                      name='getSessionsInWishlistByDate')
+    def getSessionsInWishlistByDate(self, request):
+        """Return user's wishlist, filtered by date (YYYY-MM-DD)."""
 
-        # fetch sessions in wishlist:
-        wish_list_sessions = ndb.get_multi(session_keys)
+        try:
+            date = datetime.strptime(request.date or '', "%Y-%m-%d").date()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "'date' must be given as YYYY-MM-DD")
+        return self._filterWishlist(date=date)
 
-        # query ALL sessions (not just ones in wishlist), filtered by speaker:
-        requested_session_type = Session.query(
-            Session.speaker == request.speaker)
+    @endpoints.method(CONF_GET_REQUEST, SessionForms,
+                      path='wishlist/conference',
+                      http_method='GET',
+                      name='getSessionsInWishlistByConference')
+    def getSessionsInWishlistByConference(self, request):
+        """Return user's wishlist, filtered by conference."""
 
-        # If any of the user's wishlist session matches the session query,
-        # append this session to result. Return result as SessionForms object:
-        return SessionForms(
-            items=[self._copySessionToForm(x) for x in wish_list_sessions
-                   if x in requested_session_type]
-        )
+        return self._filterWishlist(
+            conference_key=ndb.Key(urlsafe=request.websafeConferenceKey))
 
 ######################################
 #          Featured Speaker          #
@@ -953,12 +1691,15 @@ class ConferenceApi(remote.Service):
                 'No conference found with key: %s' % wsck)
 
         # create memcache key based on conf key:
-        memcache_key_ = MEMCACHE_FEATURED_SPEAKER_KEY + str(wsck)
+        memcache_key_ = MEMCACHE_FEATURED_SPEAKER_KEY + conf.key.urlsafe()
 
-        # try to find entry in memcache:
+        # try to find entry in memcache; derive it from the conference's
+        # speaker index if it's not there:
         output_ = memcache.get(memcache_key_)
+        if not output_:
+            output_ = cacheFeaturedSpeaker(conf.key)
         if output_:
-            return StringMessage(data=memcache.get(memcache_key_))
+            return StringMessage(data=output_)
         else:
             return StringMessage(
                 data="There are no featured speakers for this conference.")
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+"""converters.py
+Precompiled entity to ProtoRPC form converters
+
+formConverter() resolves, once per Model/Message pair, which form fields are
+filled and how each value is converted; the returned function then only
+reads and sets those fields, instead of reflecting on every field for every
+entity.
+"""
+
+from operator import attrgetter
+
+
+def asString(name):
+    """Field value: str() of the entity's attribute (e.g. dates, times)."""
+    get = attrgetter(name)
+    return lambda entity: str(get(entity))
+
+
+def asEnum(enum_type, name):
+    """Field value: the enum_type value named by the entity's attribute."""
+    get = attrgetter(name)
+    return lambda entity: getattr(enum_type, get(entity))
+
+
+def asWebsafeKeys(name):
+    """Field value: websafe keys of the entity's list of keys."""
+    get = attrgetter(name)
+    return lambda entity: [key.urlsafe() for key in get(entity)]
+
+
+def websafeKey(entity):
+    """Field value: the entity's websafe key."""
+    return entity.key.urlsafe()
+
+
+def formConverter(model, message_type, fields=None):
+    """Return a function copying a model entity to a new message_type form.
+
+    fields maps form field names to functions of the entity giving the
+    field's value; other form fields that are attributes of the model are
+    copied as is, and the rest are left unset. The returned function's
+    narrow(names) gives a (memoized) converter filling only the named fields,
+    for partial responses.
+    """
+
+    fields = fields or {}
+    getters = []
+    for field in message_type.all_fields():
+        if field.name in fields:
+            getters.append((field.name, fields[field.name]))
+        elif hasattr(model, field.name):
+            getters.append((field.name, attrgetter(field.name)))
+    # forms without required fields are always initialized:
+    check = any(field.required for field in message_type.all_fields())
+    convert = _converter(message_type, getters, check)
+
+    narrowed = {}
+
+    def narrow(names):
+        """Return a converter filling only the named fields (all if None)."""
+        if names is None:
+            return convert
+        names = frozenset(names)
+        if names not in narrowed:
+            narrowed[names] = _converter(
+                message_type,
+                [(name, get) for name, get in getters if name in names],
+                False)
+        return narrowed[names]
+
+    convert.narrow = narrow
+    return convert
+
+
+def _converter(message_type, getters, check):
+    """Return a function filling a new message_type form from an entity
+    with the (field name, getter) pairs."""
+
+    def convert(entity):
+        form = message_type()
+        for name, get in getters:
+            setattr(form, name, get(entity))
+        if check:
+            form.check_initialized()
+        return form
+
+    return convert
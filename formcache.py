@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+"""formcache.py
+Read-through memcache of serialized response forms
+
+Forms are cached per kind (e.g. 'conference', 'sessions') and websafe
+Conference key. Kinds in VERSIONED_KINDS are cached under a per-key version
+read before the form is built, and can have several variants per key (e.g.
+sessions filtered by type); they are invalidated all at once by bumping the
+version. So a form built from data read before an invalidation is cached
+under the old version, where nobody reads it, instead of overwriting the
+new one. Forms of other kinds are simply deleted. Hits and misses are
+counted per kind, so TTLs can be tuned.
+
+Every invalidation (or bump(), for forms that aren't cached) also changes
+the per-key version, which serves as the forms' ETag: a client that still
+has the current version needs no new copy. An evicted version restarts from
+the clock, so it never matches an earlier one.
+"""
+
+import hashlib
+import threading
+import time
+
+from google.appengine.api import memcache
+from protorpc import protojson
+
+FORM_CACHE_SECONDS = 600
+MEMCACHE_FORM_KEY = "form_"
+MEMCACHE_FORM_VERSION_KEY = "form_version_"
+MEMCACHE_FORM_STATS_KEY = "form_stats_"
+VERSIONED_KINDS = frozenset(['conference', 'sessions'])
+STATS_FLUSH_EVENTS = 50
+
+# hit/miss counts not yet added to memcache: {(kind, outcome): count}
+_pending_stats = {}
+_pending_lock = threading.Lock()
+
+
+def _statsKey(kind, outcome):
+    return '%s%s_%s' % (MEMCACHE_FORM_STATS_KEY, kind, outcome)
+
+
+def _count(kind, outcome):
+    """Count a hit or miss; counts are added to memcache in batches of
+    STATS_FLUSH_EVENTS, so counting costs no RPC per read."""
+
+    with _pending_lock:
+        _pending_stats[(kind, outcome)] = \
+            _pending_stats.get((kind, outcome), 0) + 1
+        if sum(_pending_stats.values()) < STATS_FLUSH_EVENTS:
+            return
+        pending = dict(_pending_stats)
+        _pending_stats.clear()
+    memcache.offset_multi(
+        dict((_statsKey(k, o), n) for (k, o), n in pending.items()),
+        initial_value=0)
+
+
+def getStats(kinds=('conference', 'sessions')):
+    """Return {kind: {'hit': n, 'miss': n, 'ratio': hits / reads}}, counting
+    all instances (plus this instance's unflushed counts)."""
+
+    keys = [_statsKey(kind, outcome)
+            for kind in kinds for outcome in ('hit', 'miss')]
+    counts = memcache.get_multi(keys)
+    with _pending_lock:
+        pending = dict(_pending_stats)
+
+    stats = {}
+    for kind in kinds:
+        kind_stats = {}
+        for outcome in ('hit', 'miss'):
+            kind_stats[outcome] = (
+                int(counts.get(_statsKey(kind, outcome), 0)) +
+                pending.get((kind, outcome), 0))
+        reads = kind_stats['hit'] + kind_stats['miss']
+        kind_stats['ratio'] = float(kind_stats['hit']) / reads if reads else 0
+        stats[kind] = kind_stats
+    return stats
+
+
+def _versionKey(kind, wsck):
+    return '%s%s_%s' % (MEMCACHE_FORM_VERSION_KEY, kind, wsck)
+
+
+def version(kind, wsck):
+    """Return the current version of the kind's forms for wsck. To stamp a
+    form with it, read the version before the data of the form. None if
+    memcache is unavailable."""
+
+    version_key = _versionKey(kind, wsck)
+    current = memcache.get(version_key)
+    if current is None:
+        # start from the clock, so forms cached under an evicted version are
+        # never read again
+        memcache.add(version_key, int(time.time() * 1000))
+        current = memcache.get(version_key)
+    return current
+
+
+def _formKey(kind, wsck, variant):
+    """Return the memcache key of a form."""
+
+    if kind not in VERSIONED_KINDS:
+        return '%s%s_%s' % (MEMCACHE_FORM_KEY, kind, wsck)
+    # variants are user input; hash them to keep keys short
+    return '%s%s_%s_%s_%s' % (
+        MEMCACHE_FORM_KEY, kind, wsck, version(kind, wsck),
+        hashlib.md5(variant.encode('utf-8')).hexdigest() if variant else '')
+
+
+def readThrough(kind, wsck, message_type, build, variant=''):
+    """Return the kind's form (a message_type) for the websafe key from
+    memcache, or build() it and cache it."""
+
+    memcache_key = _formKey(kind, wsck, variant)
+    data = memcache.get(memcache_key)
+    if data is not None:
+        _count(kind, 'hit')
+        return protojson.decode_message(message_type, data)
+
+    _count(kind, 'miss')
+    form = build()
+    memcache.set(memcache_key, protojson.encode_message(form),
+                 time=FORM_CACHE_SECONDS)
+    return form
+
+
+def bump(kind, key):
+    """Change the version of the kind's forms for the key (e.g. of forms
+    that aren't cached here, but have an ETag)."""
+
+    memcache.incr(_versionKey(kind, key))
+
+
+def invalidate(kind, wsck):
+    """Drop the kind's cached form(s) for the websafe key, changing their
+    version."""
+
+    if kind not in VERSIONED_KINDS:
+        memcache.delete(_formKey(kind, wsck, ''))
+    bump(kind, wsck)
+
+
+def invalidateMany(kind, wscks):
+    """Drop the kind's cached forms for several websafe keys, changing
+    their versions."""
+
+    if kind not in VERSIONED_KINDS:
+        memcache.delete_multi([_formKey(kind, wsck, '') for wsck in wscks])
+    memcache.offset_multi(dict((_versionKey(kind, wsck), 1)
+                               for wsck in wscks))
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+
+"""instrumentation.py
+Per-endpoint latency, RPC and response size statistics
+
+Every ConferenceApi endpoint (instrumentService) and every request handler
+of a webapp2 app (instrumentApp) is timed. The RPCs made while it runs are
+counted per service, through a pre-call hook on the API proxy. Latencies go
+into a fixed histogram of LATENCY_BUCKETS_MS.
+
+Like the form cache statistics, the counts are kept in process and added to
+memcache in one offset_multi per STATS_FLUSH_REQUESTS requests (or
+STATS_FLUSH_SECONDS), so recording costs no RPC per request. Endpoint
+response sizes are measured by re-encoding the response, so that is only
+done for one request in SIZE_SAMPLE_EVERY.
+"""
+
+import functools
+import itertools
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+from protorpc import protojson
+
+MEMCACHE_STATS_KEY = "request_stats_"
+MEMCACHE_METHODS_KEY = "request_stats_methods"
+STATS_FLUSH_REQUESTS = 50
+STATS_FLUSH_SECONDS = 60
+SIZE_SAMPLE_EVERY = 10
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# counted API services, by name in the stats
+RPC_SERVICES = {
+    'datastore_v3': 'datastore',
+    'memcache': 'memcache',
+    'taskqueue': 'taskqueue',
+    'urlfetch': 'urlfetch',
+    'search': 'search',
+}
+COUNTERS = (['calls', 'errors', 'total_ms', 'sized', 'response_bytes'] +
+            ['bucket_%d' % i for i in range(len(LATENCY_BUCKETS_MS) + 1)] +
+            ['rpc_%s' % name for name in sorted(RPC_SERVICES.values())])
+HOOK_NAME = 'instrumentation'
+
+# set to False to record nothing (e.g. in benchmarks counting RPCs)
+ENABLED = True
+
+# counts not yet added to memcache: {(method, counter): count}
+_pending_stats = {}
+_pending_requests = [0]
+_last_flush = [time.time()]
+_pending_lock = threading.Lock()
+# the names of the instrumented methods
+_methods = set()
+# the RPC counts of the request being recorded on this thread
+_local = threading.local()
+_hooked_apiproxy = [None]
+_size_samples = itertools.count()
+
+
+def _countRpc(service, call, request, response):
+    counts = getattr(_local, 'rpcs', None)
+    if counts is not None and service in counts:
+        counts[service] += 1
+
+
+def _hookApiProxy():
+    """Install the RPC counting hook (once per API proxy)."""
+
+    apiproxy = apiproxy_stub_map.apiproxy
+    if _hooked_apiproxy[0] is not apiproxy:
+        apiproxy.GetPreCallHooks().Append(HOOK_NAME, _countRpc)
+        _hooked_apiproxy[0] = apiproxy
+
+
+def _bucket(elapsed_ms):
+    for i, bound in enumerate(LATENCY_BUCKETS_MS):
+        if elapsed_ms <= bound:
+            return i
+    return len(LATENCY_BUCKETS_MS)
+
+
+def _statsKey(method, counter):
+    return '%s%s_%s' % (MEMCACHE_STATS_KEY, method, counter)
+
+
+def _flush(pending, methods):
+    memcache.offset_multi(
+        dict((_statsKey(m, c), n) for (m, c), n in pending.items()),
+        initial_value=0)
+    # keep the method names of every instance:
+    stored = memcache.get(MEMCACHE_METHODS_KEY) or set()
+    if not methods <= stored:
+        memcache.set(MEMCACHE_METHODS_KEY, stored | methods)
+
+
+def _record(method, elapsed_ms, rpcs, error, response_bytes=None):
+    """Add a request's measurements to the pending counts; flush them if
+    due (outside the recording, so the flush isn't counted)."""
+
+    counts = [('calls', 1), ('total_ms', int(elapsed_ms)),
+              ('bucket_%d' % _bucket(elapsed_ms), 1)]
+    counts.extend(('rpc_%s' % RPC_SERVICES[service], n)
+                  for service, n in rpcs.items() if n)
+    if error:
+        counts.append(('errors', 1))
+    if response_bytes is not None:
+        counts.extend([('sized', 1), ('response_bytes', response_bytes)])
+
+    with _pending_lock:
+        for counter, n in counts:
+            _pending_stats[(method, counter)] = \
+                _pending_stats.get((method, counter), 0) + n
+        _pending_requests[0] += 1
+        now = time.time()
+        if (_pending_requests[0] < STATS_FLUSH_REQUESTS and
+                now - _last_flush[0] < STATS_FLUSH_SECONDS):
+            return
+        pending = dict(_pending_stats)
+        _pending_stats.clear()
+        _pending_requests[0] = 0
+        _last_flush[0] = now
+        methods = set(_methods)
+    _flush(pending, methods)
+
+
+class _Recording(object):
+    """Times a request and counts its RPCs (on this thread)."""
+
+    def __init__(self, method):
+        self.method = method
+        self.responseBytes = None
+
+    def __enter__(self):
+        _hookApiProxy()
+        self.outer = getattr(_local, 'rpcs', None)
+        _local.rpcs = dict.fromkeys(RPC_SERVICES, 0)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        elapsed_ms = (time.time() - self.start) * 1000
+        rpcs = _local.rpcs
+        _local.rpcs = self.outer
+        if self.outer is not None:
+            # (a nested recording's RPCs are the outer one's too)
+            for service, n in rpcs.items():
+                self.outer[service] += n
+        _record(self.method, elapsed_ms, rpcs, exc_type is not None,
+                self.responseBytes)
+        return False
+
+
+def _instrumentMethod(name, method):
+    _methods.add(name)
+
+    @functools.wraps(method)
+    def instrumented(service, request):
+        if not ENABLED:
+            return method(service, request)
+        with _Recording(name) as recording:
+            response = method(service, request)
+            if next(_size_samples) % SIZE_SAMPLE_EVERY == 0:
+                recording.responseBytes = len(
+                    protojson.encode_message(response))
+            return response
+    return instrumented
+
+
+def instrumentService(cls):
+    """Class decorator recording the stats of every endpoint (remote
+    method) of a protorpc Service, as '<class>.<method>'; apply it below
+    @endpoints.api."""
+
+    for name in dir(cls):
+        method = getattr(cls, name)
+        if getattr(method, 'remote', None) is not None:
+            # (the wrapper keeps the remote and method_info attributes)
+            setattr(cls, name, _instrumentMethod(
+                '%s.%s' % (cls.__name__, name), method.im_func))
+    return cls
+
+
+def _handlerName(request):
+    route = getattr(request, 'route', None)
+    handler = getattr(route, 'handler', None) if route else None
+    if handler is None:
+        return 'unrouted.%s' % request.method.lower()
+    if not isinstance(handler, basestring):
+        handler = handler.__name__
+    return '%s.%s' % (handler.rsplit('.', 1)[-1], request.method.lower())
+
+
+def instrumentApp(app):
+    """Record the stats of every request handler of the webapp2 app, as
+    '<handler class>.<http method>'."""
+
+    def dispatcher(router, request, response):
+        if not ENABLED:
+            return router.default_dispatcher(request, response)
+        with _Recording(None) as recording:
+            try:
+                return router.default_dispatcher(request, response)
+            finally:
+                # (the route is known once dispatched)
+                recording.method = _handlerName(request)
+                _methods.add(recording.method)
+                recording.responseBytes = len(response.body)
+
+    app.router.set_dispatcher(dispatcher)
+    return app
+
+
+def _percentile(buckets, calls, fraction):
+    """Return the upper bound (ms) of the bucket holding the fraction of
+    the calls, or None for the overflow bucket."""
+
+    seen = 0
+    for i, count in enumerate(buckets):
+        seen += count
+        if seen >= fraction * calls:
+            return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) \
+                else None
+    return None
+
+
+def getRequestStats():
+    """Return {method: stats} for all instrumented methods that were
+    called, counting all instances (plus this instance's unflushed
+    counts)."""
+
+    methods = (memcache.get(MEMCACHE_METHODS_KEY) or set()) | _methods
+    keys = [_statsKey(m, c) for m in methods for c in COUNTERS]
+    stored = memcache.get_multi(keys)
+    with _pending_lock:
+        pending = dict(_pending_stats)
+
+    stats = {}
+    for method in sorted(methods):
+        counts = dict((c, int(stored.get(_statsKey(method, c), 0)) +
+                          pending.get((method, c), 0))
+                      for c in COUNTERS)
+        calls = counts['calls']
+        if not calls:
+            continue
+        buckets = [counts['bucket_%d' % i]
+                   for i in range(len(LATENCY_BUCKETS_MS) + 1)]
+        bounds = ['<=%d' % b for b in LATENCY_BUCKETS_MS] + \
+            ['>%d' % LATENCY_BUCKETS_MS[-1]]
+        stats[method] = {
+            'calls': calls,
+            'errors': counts['errors'],
+            'mean_ms': float(counts['total_ms']) / calls,
+            'p50_ms': _percentile(buckets, calls, 0.5),
+            'p90_ms': _percentile(buckets, calls, 0.9),
+            'p99_ms': _percentile(buckets, calls, 0.99),
+            'latency_ms': dict(zip(bounds, buckets)),
+            'rpcs_per_call': dict(
+                (name, float(counts['rpc_%s' % name]) / calls)
+                for name in sorted(RPC_SERVICES.values())),
+            'mean_response_bytes': (
+                float(counts['response_bytes']) / counts['sized']
+                if counts['sized'] else None),
+        }
+    return stats
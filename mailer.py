@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+"""mailer.py
+Batched email delivery through a pull queue
+
+queueMail() adds a message to the mail-outbox pull queue, tagged with its
+recipient, and schedules a flush. Flushes are coalesced to at most one per
+MAIL_FLUSH_SECONDS. sendQueuedMail() leases the queued messages one
+recipient (tag) at a time and sends them as a single mail, at most
+MAILS_PER_RUN mails per run and one mail per recipient per
+RECIPIENT_INTERVAL_SECONDS. Messages that fail to send are queued again
+with their attempts counted and an exponentially growing delay, and dropped
+after MAX_MAIL_ATTEMPTS.
+"""
+
+import json
+import logging
+import time
+
+from google.appengine.api import app_identity
+from google.appengine.api import mail
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.runtime import apiproxy_errors
+
+MAIL_QUEUE = 'mail-outbox'
+MAIL_FLUSH_SECONDS = 10
+MAILS_PER_RUN = 50
+MESSAGES_PER_MAIL = 100
+LEASE_SECONDS = 60
+RECIPIENT_INTERVAL_SECONDS = 60
+BACKOFF_SECONDS = 30
+MAX_BACKOFF_SECONDS = 3600
+MAX_MAIL_ATTEMPTS = 8
+MEMCACHE_MAIL_SENT_KEY = "mail_sent_"
+MAIL_SEPARATOR = '\r\n\r\n--\r\n\r\n'
+
+
+def _scheduleFlush(countdown=MAIL_FLUSH_SECONDS):
+    """Schedule a run of sendQueuedMail (at most one per period)."""
+
+    try:
+        taskqueue.add(name='send-mail-%d' % (
+                          int(time.time() + countdown) // MAIL_FLUSH_SECONDS),
+                      url='/tasks/send_mail',
+                      countdown=countdown)
+    except (taskqueue.TaskAlreadyExistsError,
+            taskqueue.TombstonedTaskError):
+        # a run is already scheduled for this period
+        pass
+
+
+def queueMail(to, subject, body):
+    """Queue a mail to be sent (batched with others to the recipient)."""
+
+    taskqueue.Queue(MAIL_QUEUE).add(taskqueue.Task(
+        payload=json.dumps({'subject': subject, 'body': body}),
+        method='PULL',
+        tag=to.encode('utf-8')))
+    _scheduleFlush()
+
+
+def _combine(messages):
+    """Return (subject, body) of one mail combining the messages."""
+
+    subject = messages[0]['subject']
+    if len(messages) > 1:
+        subject = '%s (and %d more)' % (subject, len(messages) - 1)
+    return subject, MAIL_SEPARATOR.join(m['body'] for m in messages)
+
+
+def _backoff(queue, tasks, messages):
+    """Re-queue the messages of failed tasks to be sent after an
+    exponentially growing delay; drop those out of attempts.
+
+    Failed sends are counted in the messages themselves (a task's
+    retry_count also counts the leases of rate-limited recipients)."""
+
+    retried = []
+    dropped = 0
+    for message in messages:
+        attempts = message.get('attempts', 0) + 1
+        if attempts >= MAX_MAIL_ATTEMPTS:
+            dropped += 1
+            continue
+        retried.append(taskqueue.Task(
+            payload=json.dumps(dict(message, attempts=attempts)),
+            method='PULL',
+            tag=tasks[0].tag,
+            countdown=min(BACKOFF_SECONDS * 2 ** (attempts - 1),
+                          MAX_BACKOFF_SECONDS)))
+    if dropped:
+        logging.error('Dropping %d mails to %s after %d attempts',
+                      dropped, tasks[0].tag, MAX_MAIL_ATTEMPTS)
+    if retried:
+        queue.add(retried)
+    queue.delete_tasks(tasks)
+
+
+def sendQueuedMail():
+    """Send the queued mails, one mail per recipient; returns the number of
+    mails sent. Schedules another run if mail is left (failed mails are
+    picked up again by the cron)."""
+
+    queue = taskqueue.Queue(MAIL_QUEUE)
+    sender = 'noreply@%s.appspotmail.com' % (
+        app_identity.get_application_id())
+    sent = 0
+    deferred = False
+    for _ in range(MAILS_PER_RUN * 2):
+        if sent >= MAILS_PER_RUN:
+            break
+        # leases tasks of a single recipient (the first queued one's tag)
+        tasks = queue.lease_tasks_by_tag(LEASE_SECONDS, MESSAGES_PER_MAIL)
+        if not tasks:
+            if deferred:
+                _scheduleFlush(RECIPIENT_INTERVAL_SECONDS)
+            return sent
+        to = tasks[0].tag
+
+        # rate limit per recipient; what is queued meanwhile is combined
+        if not memcache.add(MEMCACHE_MAIL_SENT_KEY + to, 1,
+                            time=RECIPIENT_INTERVAL_SECONDS):
+            for task in tasks:
+                queue.modify_task_lease(task, RECIPIENT_INTERVAL_SECONDS)
+            deferred = True
+            continue
+
+        messages = [json.loads(task.payload) for task in tasks]
+        subject, body = _combine(messages)
+        try:
+            mail.send_mail(sender, to, subject, body)
+        except (apiproxy_errors.Error, mail.Error):
+            logging.exception('Sending mail to %s failed', to)
+            memcache.delete(MEMCACHE_MAIL_SENT_KEY + to)
+            _backoff(queue, tasks, messages)
+            continue
+        queue.delete_tasks(tasks)
+        sent += 1
+
+    # over the limit for this run; continue in the next one
+    _scheduleFlush()
+    return sent
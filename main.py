@@ -1,10 +1,29 @@
 #!/usr/bin/env python
+import json
 import webapp2
-from google.appengine.api import app_identity, mail, memcache
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
+from bulk import jobStatus, resumeJob, runStep, startExport, startImport
+from conference import CONFIRMATION_BODY, CONFIRMATION_SUBJECT
 from conference import ConferenceApi
-from conference import MEMCACHE_FEATURED_SPEAKER_KEY
-from models import Session
+from formcache import getStats, invalidateMany
+from instrumentation import getRequestStats, instrumentApp
+from mailer import queueMail, sendQueuedMail
+from models import BulkJob, Conference, Profile, Session
+from profiles import upgradeProfiles
+from schedules import sessionStart
+from seats import syncSeats
+from speakers import addSpeakerSessions, cacheFeaturedSpeaker
+from speakers import updateSpeakers
+from textsearch import CONFERENCE_INDEX, SESSION_INDEX
+from textsearch import indexConferences, indexSessions, reindex
+
+ORGANIZER_NAME_BATCH_SIZE = 100
+PROFILE_KEYS_BATCH_SIZE = 100
+SEARCH_INDEX_BATCH_SIZE = 200
+SESSION_START_BATCH_SIZE = 200
+SPEAKER_BATCH_SIZE = 200
 
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
@@ -16,56 +35,301 @@ class SetAnnouncementHandler(webapp2.RequestHandler):
 
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
-        """Send email confirming Conference creation."""
+        """Queue email confirming Conference creation (for confirmation
+        tasks enqueued before mail was batched)."""
+
+        queueMail(self.request.get('email'),
+                  CONFIRMATION_SUBJECT,
+                  CONFIRMATION_BODY % self.request.get('conferenceInfo'))
+
+
+class SendMailHandler(webapp2.RequestHandler):
+    def get(self):
+        """Send queued mail in batches, one mail per recipient."""
 
-        mail.send_mail(
-            'noreply@%s.appspotmail.com' % (
-                app_identity.get_application_id()),     # from
-            self.request.get('email'),                  # to
-            'You created a new Conference!',            # subj
-            'Hi, you have created a following '         # body
-            'conference:\r\n\r\n%s' % self.request.get(
-                'conferenceInfo')
-        )
+        sendQueuedMail()
+
+    post = get
 
 
 class CheckFeaturedSpeaker(webapp2.RequestHandler):
     def post(self):
-        """Checks the speakers in given conference and if it finds more than 1
-        entry of the speaker, it sets a memcache entry to the speaker and the
-        session names the speaker is in.
+        """Sets the featured speaker memcache entry of the given conference
+        from its speaker index (speaker and the session names the speaker is
+        in), if a speaker has more than 1 session.
+        """
+
+        cacheFeaturedSpeaker(ndb.Key(urlsafe=self.request.get('wsck')))
+
+
+class SyncSeatsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy a Conference's sharded seat total to its seatsAvailable."""
+
+        syncSeats(ndb.Key(urlsafe=self.request.get('wsck')))
+
+
+@ndb.transactional
+def _setOrganizerName(p_key, c_keys):
+    """Copy the Profile's displayName onto the given Conferences (children
+    of the Profile, so a single entity group)."""
+
+    entities = ndb.get_multi([p_key] + c_keys)
+    prof, conferences = entities[0], entities[1:]
+    display_name = getattr(prof, 'displayName', None)
+
+    changed = [conf for conf in conferences
+               if conf and conf.organizerDisplayName != display_name]
+    for conf in changed:
+        conf.organizerDisplayName = display_name
+    ndb.put_multi(changed)
+    return [conf.key for conf in changed]
+
+
+class UpdateOrganizerNameHandler(webapp2.RequestHandler):
+    def post(self):
+        """Update the organizer name stored on a user's Conferences, one
+        batch per task; re-enqueues itself with a cursor until done.
         """
 
-        speaker_ = self.request.get('speaker')
-        if speaker_ != "none":
-            memcache_output = []
-            wsck = self.request.get('wsck')
-            conf = ndb.Key(urlsafe=wsck).get()
+        user_id = self.request.get('userId')
+        p_key = ndb.Key(Profile, user_id)
+        token = self.request.get('cursor')
 
-            # search sessions for multiple instances of the same speaker:
-            sessions_in_conf = Session.query(ancestor=conf.key)
-            for x in sessions_in_conf:
-                # if we find a match, add session to output:
-                if x.speaker == speaker_:
-                    memcache_output.append(str(x.name))
+        c_keys, cursor, more = Conference.query(ancestor=p_key).fetch_page(
+            ORGANIZER_NAME_BATCH_SIZE,
+            start_cursor=Cursor(urlsafe=token) if token else None,
+            keys_only=True)
+        changed = _setOrganizerName(p_key, c_keys)
+        invalidateMany('conference', [c_key.urlsafe() for c_key in changed])
 
-            # if memcache_output is greater than 1, we have a featured speaker:
-            if len(memcache_output) > 1:
-                # create unique memcache key for conference (using conf key):
-                memcache_key = MEMCACHE_FEATURED_SPEAKER_KEY + str(wsck)
+        if more and cursor:
+            taskqueue.add(params={'userId': user_id,
+                                  'cursor': cursor.urlsafe()},
+                          url='/tasks/update_organizer_name')
 
-                # cast memcache_output as string:
-                memcache_output = ', '.join(memcache_output)
 
-                # set memcache on datastore using key, speaker, and output:
-                memcache.set(memcache_key, "Featured Speaker: {}. Sessions: {}"
-                                           "".format(speaker_,
-                                                     memcache_output))
+class BackfillOrganizerNamesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Enqueue an organizer name update for every Profile; used once to
+        fill in Conferences created before names were stored on them.
+        """
+
+        token = self.request.get('cursor')
+        p_keys, cursor, more = Profile.query().fetch_page(
+            ORGANIZER_NAME_BATCH_SIZE,
+            start_cursor=Cursor(urlsafe=token) if token else None,
+            keys_only=True)
+
+        tasks = [taskqueue.Task(params={'userId': p_key.id()},
+                                url='/tasks/update_organizer_name')
+                 for p_key in p_keys]
+        if more and cursor:
+            tasks.append(taskqueue.Task(params={'cursor': cursor.urlsafe()},
+                                        url='/tasks/backfill_organizer_names',
+                                        method='GET'))
+        if tasks:
+            taskqueue.Queue().add(tasks)
+
+
+class BackfillProfileKeysHandler(webapp2.RequestHandler):
+    def get(self):
+        """Upgrade the websafe key strings stored in Profiles to keys, and
+        move their registrations to Attendance entities, one batch per task;
+        re-enqueues itself with a cursor until done.
+        """
+
+        token = self.request.get('cursor')
+        profiles, cursor, more = Profile.query().fetch_page(
+            PROFILE_KEYS_BATCH_SIZE,
+            start_cursor=Cursor(urlsafe=token) if token else None)
+        upgradeProfiles(profiles)
+
+        if more and cursor:
+            taskqueue.add(params={'cursor': cursor.urlsafe()},
+                          url='/tasks/backfill_profile_keys',
+                          method='GET')
+
+
+class UpdateSpeakersHandler(webapp2.RequestHandler):
+    def post(self):
+        """Apply the changes of written or deleted Sessions to their
+        Speakers."""
+
+        updateSpeakers(json.loads(self.request.body))
+
+
+class BackfillSpeakersHandler(webapp2.RequestHandler):
+    def get(self):
+        """Add all Sessions to their Speakers, one batch per task;
+        re-enqueues itself with a cursor until done. Used once to create
+        the Speakers of Sessions from before Speaker entities.
+        """
+
+        token = self.request.get('cursor')
+        sessions, cursor, more = Session.query().fetch_page(
+            SPEAKER_BATCH_SIZE,
+            start_cursor=Cursor(urlsafe=token) if token else None)
+        addSpeakerSessions(sessions)
+
+        if more and cursor:
+            taskqueue.add(params={'cursor': cursor.urlsafe()},
+                          url='/tasks/backfill_speakers',
+                          method='GET')
+
+
+class BackfillSessionStartsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Set the startDateTime of all Sessions, one batch per task;
+        re-enqueues itself with a cursor until done. Used once, so
+        querySessions finds Sessions from before startDateTime.
+        """
+
+        token = self.request.get('cursor')
+        sessions, cursor, more = Session.query().fetch_page(
+            SESSION_START_BATCH_SIZE,
+            start_cursor=Cursor(urlsafe=token) if token else None)
+        changed = []
+        for session_ in sessions:
+            start = sessionStart(session_.date, session_.startTime)
+            if session_.startDateTime != start:
+                session_.startDateTime = start
+                changed.append(session_)
+        ndb.put_multi(changed)
+
+        if more and cursor:
+            taskqueue.add(params={'cursor': cursor.urlsafe()},
+                          url='/tasks/backfill_session_starts',
+                          method='GET')
+
+
+class IndexDocumentsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Retry indexing entities (by websafe key) for full-text search."""
+
+        reindex(self.request.get('index'), self.request.get_all('keys'))
+
+
+class ReindexSearchHandler(webapp2.RequestHandler):
+    def get(self):
+        """Add all Conferences, then all Sessions, to the search index, one
+        batch per task; re-enqueues itself with a cursor until done. Used
+        once to index entities from before full-text search.
+        """
+
+        index_name = self.request.get('index') or CONFERENCE_INDEX
+        model, index = {
+            CONFERENCE_INDEX: (Conference, indexConferences),
+            SESSION_INDEX: (Session, indexSessions),
+        }[index_name]
+        token = self.request.get('cursor')
+        entities, cursor, more = model.query().fetch_page(
+            SEARCH_INDEX_BATCH_SIZE,
+            start_cursor=Cursor(urlsafe=token) if token else None)
+        index(entities)
+
+        if more and cursor:
+            params = {'index': index_name, 'cursor': cursor.urlsafe()}
+        elif index_name == CONFERENCE_INDEX:
+            params = {'index': SESSION_INDEX}
+        else:
+            return
+        taskqueue.add(params=params, url='/tasks/reindex_search',
+                      method='GET')
+
+
+class CacheStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return form cache hit/miss counts per kind, as JSON."""
+
+        self.response.content_type = 'application/json'
+        self.response.write(json.dumps(getStats()))
+
+
+class RequestStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return latency, RPC and response size stats per endpoint and
+        handler, as JSON."""
+
+        self.response.content_type = 'application/json'
+        self.response.write(json.dumps(getRequestStats(), indent=1,
+                                       sort_keys=True))
+
+
+class BulkStepHandler(webapp2.RequestHandler):
+    def post(self):
+        """Run one step of a bulk export or import job."""
+
+        runStep(int(self.request.get('job')), int(self.request.get('step')))
+
+
+class BulkJobHandler(webapp2.RequestHandler):
+    def _jobFromRequest(self):
+        job_id = self.request.get('job')
+        if not job_id.isdigit():
+            self.abort(400, 'job id required')
+        return int(job_id)
+
+    def _writeStatus(self, job):
+        self.response.content_type = 'application/json'
+        self.response.write(json.dumps(jobStatus(job)))
+
+    def get(self, action):
+        """Get the status of a job (status?job=id), as JSON."""
+
+        if action != 'status':
+            # starting or resuming a job changes state; POST only
+            self.abort(405, 'Use POST to %s a job' % action,
+                       headers=[('Allow', 'POST')])
+        job_id = self._jobFromRequest()
+        job = BulkJob.get_by_id(job_id)
+        if not job:
+            self.abort(404, 'No bulk job found with id: %s' % job_id)
+        self._writeStatus(job)
+
+    def post(self, action):
+        """Start a bulk export, or an import (path=/bucket/prefix), of
+        conferences with their sessions as JSONL; or resume (job=id) a job.
+        Responds with the job's status, as JSON.
+        """
+
+        if action == 'export':
+            job = startExport()
+        elif action == 'import':
+            path = self.request.get('path')
+            if not path.startswith('/'):
+                self.abort(400, 'path must be /bucket/prefix')
+            job = startImport(path)
+        elif action == 'resume':
+            job_id = self._jobFromRequest()
+            job = resumeJob(job_id)
+            if not job:
+                self.abort(404, 'No bulk job found with id: %s' % job_id)
+        else:
+            self.abort(405, 'Use GET for the %s of a job' % action,
+                       headers=[('Allow', 'GET')])
+        self._writeStatus(job)
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 app = webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
-    ('/tasks/set_featured_speaker', CheckFeaturedSpeaker)
+    ('/tasks/send_mail', SendMailHandler),
+    ('/tasks/set_featured_speaker', CheckFeaturedSpeaker),
+    ('/tasks/update_organizer_name', UpdateOrganizerNameHandler),
+    ('/tasks/backfill_organizer_names', BackfillOrganizerNamesHandler),
+    ('/tasks/sync_seats', SyncSeatsHandler),
+    ('/tasks/backfill_profile_keys', BackfillProfileKeysHandler),
+    ('/tasks/update_speakers', UpdateSpeakersHandler),
+    ('/tasks/backfill_speakers', BackfillSpeakersHandler),
+    ('/tasks/backfill_session_starts', BackfillSessionStartsHandler),
+    ('/tasks/index_documents', IndexDocumentsHandler),
+    ('/tasks/reindex_search', ReindexSearchHandler),
+    ('/tasks/bulk_export', BulkStepHandler),
+    ('/tasks/bulk_import', BulkStepHandler),
+    ('/admin/cache_stats', CacheStatsHandler),
+    ('/admin/request_stats', RequestStatsHandler),
+    (r'/admin/bulk/(export|import|status|resume)', BulkJobHandler)
 ], debug=True)
+instrumentApp(app)
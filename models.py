@@ -44,8 +44,26 @@ class Profile(ndb.Model):
     displayName             = ndb.StringProperty()
     mainEmail               = ndb.StringProperty()
     teeShirtSize            = ndb.StringProperty(default='NOT_SPECIFIED')
-    conferenceKeysToAttend  = ndb.StringProperty(repeated=True)
-    wishListKeys            = ndb.StringProperty(repeated=True)
+    # registrations from before Attendance entities; moved to those as
+    # Profiles are used (see profiles.py)
+    conferenceKeysToAttend  = ndb.KeyProperty('conferencesToAttend',
+                                              kind='Conference',
+                                              repeated=True)
+    wishListKeys            = ndb.KeyProperty('wishList', kind='Session',
+                                              repeated=True)
+    # websafe key strings, stored before the above held keys (see
+    # profiles.py)
+    legacyConferenceKeys    = ndb.StringProperty('conferenceKeysToAttend',
+                                                 repeated=True)
+    legacyWishListKeys      = ndb.StringProperty('wishListKeys',
+                                                 repeated=True)
+
+
+class Attendance(ndb.Model):
+    """A Profile's registration for a Conference; child of the Profile, with
+    the websafe Conference key as id"""
+
+    conference      = ndb.KeyProperty(kind='Conference', required=True)
 
 
 class ProfileForm(messages.Message):
@@ -56,6 +74,22 @@ class ProfileForm(messages.Message):
     mainEmail       = messages.StringField(3)
     teeShirtSize    = messages.EnumField('TeeShirtSize', 4)
     wishListKeys    = messages.StringField(5, repeated=True)
+    etag            = messages.StringField(6)
+    notModified     = messages.BooleanField(7)
+
+
+class AttendeeForm(messages.Message):
+    """Conference attendee outbound form message"""
+
+    userId          = messages.StringField(1)
+    displayName     = messages.StringField(2)
+
+
+class AttendeeForms(messages.Message):
+    """Multiple AttendeeForm outbound form message"""
+
+    items           = messages.MessageField(AttendeeForm, 1, repeated=True)
+    nextPageToken   = messages.StringField(2)
 
 
 class TeeShirtSize(messages.Enum):
@@ -81,16 +115,51 @@ class TeeShirtSize(messages.Enum):
 class Conference(ndb.Model):
     """Conference object"""
 
-    name            = ndb.StringProperty(required=True)
-    description     = ndb.StringProperty()
-    organizerUserId = ndb.StringProperty()
-    topics          = ndb.StringProperty(repeated=True)
-    city            = ndb.StringProperty()
-    startDate       = ndb.DateProperty()
-    month           = ndb.IntegerProperty()
-    endDate         = ndb.DateProperty()
-    maxAttendees    = ndb.IntegerProperty()
-    seatsAvailable  = ndb.IntegerProperty()
+    name                    = ndb.StringProperty(required=True)
+    description             = ndb.StringProperty()
+    organizerUserId         = ndb.StringProperty()
+    organizerDisplayName    = ndb.StringProperty(indexed=False)
+    topics                  = ndb.StringProperty(repeated=True)
+    city                    = ndb.StringProperty()
+    startDate               = ndb.DateProperty()
+    month                   = ndb.IntegerProperty()
+    endDate                 = ndb.DateProperty()
+    maxAttendees            = ndb.IntegerProperty()
+    seatsAvailable          = ndb.IntegerProperty()
+    seatShards              = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class SeatShard(ndb.Model):
+    """Share of a Conference's available seats (see seats.py)"""
+
+    # shards change on every registration; only cache them per request
+    _use_memcache = False
+
+    seatsAvailable  = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class Announcement(ndb.Model):
+    """Conferences that are nearly sold out, maintained by registration"""
+
+    # {websafe Conference key: Conference name}
+    nearlySoldOut   = ndb.JsonProperty()
+
+
+class BulkJob(ndb.Model):
+    """Progress of a bulk export or import of conferences (see bulk.py)"""
+
+    operation       = ndb.StringProperty(choices=['export', 'import'])
+    path            = ndb.StringProperty(indexed=False)
+    step            = ndb.IntegerProperty(default=0, indexed=False)
+    # where the next step starts: a query cursor (export), or a file and a
+    # byte offset into it (import)
+    cursor          = ndb.StringProperty(indexed=False)
+    fileName        = ndb.StringProperty(indexed=False)
+    offset          = ndb.IntegerProperty(default=0, indexed=False)
+    conferences     = ndb.IntegerProperty(default=0, indexed=False)
+    done            = ndb.BooleanProperty(default=False)
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+    updated         = ndb.DateTimeProperty(auto_now=True)
 
 
 class ConferenceForm(messages.Message):
@@ -108,12 +177,15 @@ class ConferenceForm(messages.Message):
     endDate                 = messages.StringField(10)
     websafeKey              = messages.StringField(11)
     organizerDisplayName    = messages.StringField(12)
+    etag                    = messages.StringField(13)
+    notModified             = messages.BooleanField(14)
 
 
 class ConferenceForms(messages.Message):
     """Multiple Conference outbound form message"""
 
-    items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    items           = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken   = messages.StringField(2)
 
 
 class ConferenceQueryForm(messages.Message):
@@ -127,7 +199,10 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """Multiple ConferenceQueryForm inbound form message"""
 
-    filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    filters     = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize    = messages.IntegerField(2)
+    pageToken   = messages.StringField(3)
+    select      = messages.StringField(4)
 
 
 class StringMessage(messages.Message):
@@ -152,6 +227,9 @@ class Session(ndb.Model):
     typeOfSession   = ndb.StringProperty()
     duration        = ndb.TimeProperty()
     highlights      = ndb.StringProperty(repeated=True)
+    # date and startTime combined, to order queries by (see
+    # schedules.sessionStart)
+    startDateTime   = ndb.DateTimeProperty()
 
 
 class SessionForm(messages.Message):
@@ -170,4 +248,51 @@ class SessionForm(messages.Message):
 class SessionForms(messages.Message):
     """Multiple Conference outbound form message"""
 
-    items = messages.MessageField(SessionForm, 1, repeated=True)
+    items           = messages.MessageField(SessionForm, 1, repeated=True)
+    nextPageToken   = messages.StringField(2)
+    etag            = messages.StringField(3)
+    notModified     = messages.BooleanField(4)
+
+
+class SessionQueryForm(messages.Message):
+    """Session query inbound form message"""
+
+    field       = messages.StringField(1)
+    operator    = messages.StringField(2)
+    value       = messages.StringField(3)
+
+
+class SessionQueryForms(messages.Message):
+    """Multiple SessionQueryForm inbound form message"""
+
+    filters                 = messages.MessageField(SessionQueryForm, 1,
+                                                    repeated=True)
+    websafeConferenceKey    = messages.StringField(2)
+    pageSize                = messages.IntegerField(3)
+    pageToken               = messages.StringField(4)
+
+
+class SpeakerIndex(ndb.Model):
+    """Per-conference index of speakers to their sessions (see speakers.py)"""
+
+    # {speaker: {session id: session name}}
+    sessions        = ndb.JsonProperty(compressed=True)
+    featuredSpeaker = ndb.StringProperty(indexed=False)
+
+
+class Schedule(ndb.Model):
+    """Per-conference schedule of its sessions (see schedules.py)"""
+
+    # [session form fields], sorted by date and start time
+    sessions        = ndb.JsonProperty(compressed=True)
+    # [{'date': date, 'types': {type: [positions in sessions]}}], by date
+    days            = ndb.JsonProperty(compressed=True)
+
+
+class Speaker(ndb.Model):
+    """A speaker across conferences, keyed by normalized name, with the
+    sessions they give (see speakers.py)"""
+
+    name            = ndb.StringProperty(indexed=False)
+    sessionKeys     = ndb.KeyProperty(kind='Session', repeated=True,
+                                      indexed=False)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""profiles.py
+Profile references stored as keys, and registrations as Attendance entities
+
+Profile.wishListKeys holds Keys. Profiles written before then hold websafe
+key strings instead, in the legacy properties (under the old datastore
+names). upgradeProfile() moves those over in memory whenever a Profile is
+read, so its next put stores it upgraded.
+
+Registrations are Attendance entities (children of the Profile, keyed by
+Conference), so registering writes one small entity instead of rewriting the
+Profile, and attendees can be queried by Conference. Registrations still
+listed on a Profile (conferenceKeysToAttend) are moved to Attendance entities
+by moveRegistrations() when the user next (un)registers; upgradeProfiles()
+does both upgrades for stored Profiles, for the backfill.
+"""
+
+from google.appengine.ext import ndb
+
+from models import Attendance
+
+
+def _mergeKeys(websafe_keys, keys):
+    """Return the keys of the websafe key strings followed by the keys,
+    without duplicates."""
+
+    merged = []
+    seen = set()
+    for key in [ndb.Key(urlsafe=wsk) for wsk in websafe_keys] + list(keys):
+        if key not in seen:
+            seen.add(key)
+            merged.append(key)
+    return merged
+
+
+def upgradeProfile(prof):
+    """Move the Profile's legacy websafe key strings into its key
+    properties (in memory); returns True if there were any."""
+
+    if not (prof.legacyConferenceKeys or prof.legacyWishListKeys):
+        return False
+    prof.conferenceKeysToAttend = _mergeKeys(prof.legacyConferenceKeys,
+                                             prof.conferenceKeysToAttend)
+    prof.wishListKeys = _mergeKeys(prof.legacyWishListKeys,
+                                   prof.wishListKeys)
+    prof.legacyConferenceKeys = []
+    prof.legacyWishListKeys = []
+    return True
+
+
+def attendanceKey(p_key, c_key):
+    """Return the key of the Profile's Attendance of the Conference."""
+    return ndb.Key(Attendance, c_key.urlsafe(), parent=p_key)
+
+
+def moveRegistrations(prof):
+    """Move the registrations listed on the Profile to new Attendance
+    entities (in memory); returns those, for the caller to put along with
+    the Profile."""
+
+    upgradeProfile(prof)
+    moved = [Attendance(key=attendanceKey(prof.key, c_key), conference=c_key)
+             for c_key in prof.conferenceKeysToAttend]
+    prof.conferenceKeysToAttend = []
+    return moved
+
+
+def attendedConferenceKeys(prof):
+    """Return the keys of the Conferences the Profile is registered for."""
+
+    # ancestor query, so registrations just written are included
+    a_keys = Attendance.query(ancestor=prof.key).fetch(keys_only=True)
+    c_keys = [ndb.Key(urlsafe=a_key.id()) for a_key in a_keys]
+    # registrations not moved to Attendance entities yet:
+    return _mergeKeys(prof.legacyConferenceKeys,
+                      prof.conferenceKeysToAttend + c_keys)
+
+
+@ndb.transactional
+def _upgradeStoredProfile(p_key):
+    prof = p_key.get()
+    if prof:
+        upgraded = upgradeProfile(prof)
+        moved = moveRegistrations(prof)
+        if upgraded or moved:
+            ndb.put_multi([prof] + moved)
+
+
+def upgradeProfiles(profiles):
+    """Upgrade the stored copies of those of the (fetched) Profiles that
+    still have legacy references or listed registrations; returns how many
+    were upgraded."""
+
+    legacy = [prof.key for prof in profiles
+              if prof.legacyConferenceKeys or prof.legacyWishListKeys or
+              prof.conferenceKeysToAttend]
+    for p_key in legacy:
+        _upgradeStoredProfile(p_key)
+    return len(legacy)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+"""schedules.py
+Materialized per-conference schedule
+
+Each Conference has one Schedule child entity holding its Sessions' forms,
+sorted by date and start time and grouped by day and type. It is in the
+Conference's entity group, so it is updated in the same transaction that
+writes (or deletes) the Sessions (see speakers.putSessions), and reading a
+conference's sessions is a single key read (which ndb serves from memcache
+when it can). Schedules of conferences from before, or dropped by a bulk
+import, are built from the Sessions on first use.
+
+Being one entity, a schedule must stay under the datastore's entity size
+limit: a conference may have at most MAX_SESSIONS_PER_CONFERENCE sessions,
+and a write that would make its schedule larger than MAX_SCHEDULE_BYTES
+(compressed) fails with ScheduleFullError.
+"""
+
+from datetime import datetime
+from datetime import time as time_
+import json
+import logging
+import zlib
+
+from google.appengine.ext import ndb
+
+from converters import asString, formConverter, websafeKey
+from models import Schedule, Session, SessionForm, SessionForms
+
+SCHEDULE_ID = 'schedule'
+MAX_SESSIONS_PER_CONFERENCE = 1000
+# below the 1 MB entity limit, leaving room for the rest of the entity
+MAX_SCHEDULE_BYTES = 900 * 1024
+# the startDateTime of sessions without a date, so they sort last
+UNDATED_START = datetime.max
+SESSION_FIELDS = [field.name for field in SessionForm.all_fields()]
+
+# entity to form converter; other fields are copied as is
+SESSION_TO_FORM = formConverter(Session, SessionForm, {
+    # convert date, time, and duration to string
+    'date':         asString('date'),
+    'startTime':    asString('startTime'),
+    'duration':     asString('duration'),
+    'websafeKey':   websafeKey,
+})
+
+
+def sessionStart(date, start_time):
+    """Return the startDateTime of a Session with the date and startTime
+    (midnight if it has no startTime)."""
+
+    if not date:
+        return UNDATED_START
+    return datetime.combine(date, start_time or time_())
+
+
+class ScheduleFullError(ValueError):
+    """A write would take a schedule over its limits."""
+
+
+def scheduleKey(c_key):
+    """Return the key of the Conference's Schedule."""
+    return ndb.Key(Schedule, SCHEDULE_ID, parent=c_key)
+
+
+def _sessionEntry(session_):
+    """Return the schedule entry of a Session: its form's set fields."""
+
+    form = SESSION_TO_FORM(session_)
+    entry = {}
+    for name in SESSION_FIELDS:
+        value = getattr(form, name)
+        if value not in (None, []):
+            entry[name] = value
+    return entry
+
+
+def _setEntries(schedule, entries):
+    """Sort the entries into the schedule and group them by day and type
+    (in memory)."""
+
+    entries.sort(key=lambda e: (e.get('date', ''), e.get('startTime', ''),
+                                e.get('name', '')))
+    days = []
+    for position, entry in enumerate(entries):
+        date = entry.get('date', '')
+        if not days or days[-1]['date'] != date:
+            days.append({'date': date, 'types': {}})
+        days[-1]['types'].setdefault(
+            entry.get('typeOfSession', ''), []).append(position)
+    schedule.sessions = entries
+    schedule.days = days
+
+
+def _buildSchedule(c_key):
+    """Build a Conference's Schedule from its Sessions."""
+
+    schedule = Schedule(key=scheduleKey(c_key))
+    _setEntries(schedule, [_sessionEntry(session_) for session_ in
+                           Session.query(ancestor=c_key)])
+    return schedule
+
+
+def getSchedule(c_key):
+    """Return the Conference's Schedule, building it if it doesn't exist
+    yet. Must be called in a transaction on the Conference's entity group.
+    """
+
+    return scheduleKey(c_key).get() or _buildSchedule(c_key)
+
+
+def scheduleFits(schedule):
+    """Return whether the schedule's sessions (compressed, as stored) are
+    within MAX_SCHEDULE_BYTES."""
+    return len(zlib.compress(json.dumps(schedule.sessions))) <= \
+        MAX_SCHEDULE_BYTES
+
+
+def updateSchedule(schedule, added=(), removed_keys=()):
+    """Put written Sessions into the schedule (replacing their old entries)
+    and take deleted ones out (in memory). Raises ScheduleFullError if
+    sessions are added beyond the schedule's limits."""
+
+    before = len(schedule.sessions or [])
+    gone = set(s_key.urlsafe() for s_key in removed_keys)
+    gone.update(session_.key.urlsafe() for session_ in added)
+    entries = [entry for entry in schedule.sessions or []
+               if entry['websafeKey'] not in gone]
+    entries.extend(_sessionEntry(session_) for session_ in added)
+    if not added:
+        _setEntries(schedule, entries)
+        return
+
+    # (only growing is refused, so conferences from before the limit can
+    # still edit their sessions)
+    if len(entries) > max(before, MAX_SESSIONS_PER_CONFERENCE):
+        raise ScheduleFullError(
+            'A conference may have at most %d sessions'
+            % MAX_SESSIONS_PER_CONFERENCE)
+    _setEntries(schedule, entries)
+    if not scheduleFits(schedule):
+        raise ScheduleFullError(
+            "The conference's sessions are too large to add more")
+
+
+@ndb.transactional
+def loadSchedule(c_key):
+    """Return the Conference's Schedule, building and storing it if it
+    doesn't exist yet."""
+
+    schedule = scheduleKey(c_key).get()
+    if not schedule:
+        schedule = _buildSchedule(c_key)
+        if scheduleFits(schedule):
+            schedule.put()
+        else:
+            # (sessions from before the limits); served unstored
+            logging.warning('Schedule of %s too large to store',
+                            c_key.urlsafe())
+    return schedule
+
+
+def scheduleForms(schedule, type_of_session=None, select=None):
+    """Return the schedule's sessions as SessionForms, in order; only those
+    of type_of_session if given, and only the select fields if given."""
+
+    entries = schedule.sessions or []
+    if type_of_session is not None:
+        positions = []
+        for day in schedule.days or []:
+            positions.extend(day['types'].get(type_of_session, []))
+        entries = [entries[position] for position in positions]
+
+    items = []
+    for entry in entries:
+        form = SessionForm()
+        for name, value in entry.items():
+            if select is None or name in select:
+                setattr(form, name, value)
+        items.append(form)
+    return SessionForms(items=items)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+"""seats.py
+Sharded seat counters for conference registration
+
+A Conference's available seats are split across SeatShard entities. Shards
+are root entities (each its own entity group), so concurrent registrations
+for the same conference write to different groups instead of all contending
+on the Conference. Conference.seatsAvailable is kept as a snapshot of the
+total for queries; forms use the exact total from the shards.
+"""
+
+import random
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import SeatShard
+
+SEAT_SHARDS = 20
+MEMCACHE_SEATS_KEY = "seats_available_"
+SEATS_CACHE_SECONDS = 60
+SEATS_SYNC_SECONDS = 10
+
+
+def _shardKey(c_key, index):
+    """Return the key of the index'th seat shard of a Conference."""
+    return ndb.Key(SeatShard, '%s:%d' % (c_key.urlsafe(), index))
+
+
+def shardKeys(conf):
+    """Return the keys of all of the Conference's seat shards."""
+    return [_shardKey(conf.key, i) for i in range(conf.seatShards or 0)]
+
+
+def newSeatShards(c_key, seats, capacity):
+    """Split seats across new SeatShards for a Conference.
+
+    The number of shards is capped by capacity (maxAttendees) so no shard is
+    created that could never hold a seat. Returns a (shard count, shards)
+    tuple; the caller puts the shards.
+    """
+
+    count = min(SEAT_SHARDS, max(capacity, 0))
+    shards = []
+    for i in range(count):
+        share = seats // count + (1 if i < seats % count else 0)
+        shards.append(SeatShard(key=_shardKey(c_key, i),
+                                seatsAvailable=share))
+    return count, shards
+
+
+@ndb.transactional(xg=True)
+def ensureSeatShards(c_key):
+    """Shard the seats of a Conference created before seat sharding.
+
+    Does nothing if the Conference is already sharded; returns the
+    Conference as stored.
+    """
+
+    conf = c_key.get()
+    if conf.seatShards or not conf.maxAttendees:
+        return conf
+    conf.seatShards, shards = newSeatShards(
+        c_key, conf.seatsAvailable or 0, conf.maxAttendees)
+    ndb.put_multi([conf] + shards)
+    return conf
+
+
+def candidateShardKeys(conf):
+    """Return the keys of the Conference's shards that have seats left, in
+    random order. Read outside of a transaction; callers must re-check.
+    """
+
+    shards = ndb.get_multi(shardKeys(conf), use_cache=False)
+    keys = [shard.key for shard in shards
+            if shard and shard.seatsAvailable > 0]
+    random.shuffle(keys)
+    return keys
+
+
+def randomShardKey(conf):
+    """Return the key of a random shard of the Conference, or None."""
+
+    if not conf.seatShards:
+        return None
+    return _shardKey(conf.key, random.randrange(conf.seatShards))
+
+
+def getSeatsAvailable(conferences):
+    """Return the exact seats available for each Conference, keyed by
+    Conference key. Totals are cached in memcache, where seat changes update
+    them atomically (see seatsChanged).
+    """
+
+    totals = {}
+    sharded = {}
+    for conf in conferences:
+        if conf.seatShards:
+            sharded[MEMCACHE_SEATS_KEY + conf.key.urlsafe()] = conf
+        else:
+            totals[conf.key] = conf.seatsAvailable
+
+    cached = memcache.get_multi(sharded.keys()) if sharded else {}
+    missing = []
+    for memcache_key, conf in sharded.items():
+        if memcache_key in cached:
+            totals[conf.key] = cached[memcache_key]
+        else:
+            missing.append(conf)
+
+    if missing:
+        # sum the shards of all cache misses from one batch get:
+        shards = ndb.get_multi([s_key for conf in missing
+                                for s_key in shardKeys(conf)],
+                               use_cache=False)
+        recomputed = {}
+        for conf in missing:
+            total = sum(shard.seatsAvailable
+                        for shard in shards[:conf.seatShards] if shard)
+            shards = shards[conf.seatShards:]
+            totals[conf.key] = total
+            recomputed[MEMCACHE_SEATS_KEY + conf.key.urlsafe()] = total
+        # add, not set: a seat change may have updated the entry meanwhile
+        memcache.add_multi(recomputed, time=SEATS_CACHE_SECONDS)
+
+    return totals
+
+
+def fillSeatsAvailable(conferences):
+    """Set seatsAvailable on the (in-memory) Conferences to the exact total
+    from their shards, ready for copying to forms.
+    """
+
+    totals = getSeatsAvailable(conferences)
+    for conf in conferences:
+        conf.seatsAvailable = totals[conf.key]
+    return conferences
+
+
+def seatsChanged(conf, delta):
+    """Call after a committed change of delta seats: update the cached total
+    and schedule a sync of Conference.seatsAvailable (at most one per
+    SEATS_SYNC_SECONDS). Returns the new total.
+    """
+
+    c_key = conf.key
+    wsck = c_key.urlsafe()
+    memcache_key = MEMCACHE_SEATS_KEY + wsck
+    if delta < 0:
+        total = memcache.decr(memcache_key, -delta)
+    else:
+        total = memcache.incr(memcache_key, delta)
+    if total is None:
+        # not cached; sum the shards (which include this change)
+        total = getSeatsAvailable([conf])[c_key]
+
+    try:
+        taskqueue.add(name='sync-seats-%s-%d' % (
+                          wsck, int(time.time() // SEATS_SYNC_SECONDS)),
+                      params={'wsck': wsck},
+                      url='/tasks/sync_seats',
+                      countdown=SEATS_SYNC_SECONDS)
+    except (taskqueue.TaskAlreadyExistsError,
+            taskqueue.TombstonedTaskError):
+        # a sync is already scheduled for this period
+        pass
+    return total
+
+
+@ndb.transactional
+def _setSeatsAvailable(c_key, total):
+    """Write the seats available snapshot to the Conference."""
+
+    conf = c_key.get()
+    if conf and conf.seatsAvailable != total:
+        conf.seatsAvailable = total
+        conf.put()
+
+
+def syncSeats(c_key):
+    """Copy the sharded total to Conference.seatsAvailable, which queries
+    (e.g. for the announcement) filter on.
+    """
+
+    conf = c_key.get()
+    if not conf or not conf.seatShards:
+        return
+    shards = ndb.get_multi(shardKeys(conf), use_cache=False)
+    _setSeatsAvailable(c_key,
+                       sum(shard.seatsAvailable for shard in shards if shard))
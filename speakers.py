@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+
+"""speakers.py
+Per-conference speaker index, featured speaker, and Speaker entities
+
+Each Conference has one SpeakerIndex child entity mapping speakers to the
+Sessions they give. It is in the Conference's entity group, so it is updated
+in the same transaction that writes (or deletes) the Sessions, and the
+featured speaker is derived from it without scanning the Sessions. The
+Conference's Schedule (see schedules.py) is updated in the same transaction.
+
+Across conferences, each speaker has a Speaker entity keyed by the
+normalized name (case, punctuation and spacing ignored), listing the keys of
+their Sessions. Speakers are in their own entity groups, so the same
+transaction enqueues a task that applies the Sessions' changes to them.
+"""
+
+import json
+import re
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Session, Speaker, SpeakerIndex
+from schedules import getSchedule, scheduleFits, updateSchedule
+
+MEMCACHE_FEATURED_SPEAKER_KEY = "featured_speaker_"
+SPEAKER_INDEX_ID = 'speakers'
+NO_SPEAKER = 'none'
+UPDATE_SPEAKERS_URL = '/tasks/update_speakers'
+
+
+def speakerIndexKey(c_key):
+    """Return the key of the Conference's SpeakerIndex."""
+    return ndb.Key(SpeakerIndex, SPEAKER_INDEX_ID, parent=c_key)
+
+
+def _addSession(index, session_):
+    """Add a Session to the index (in memory)."""
+    if session_.speaker and session_.speaker != NO_SPEAKER:
+        index.sessions.setdefault(session_.speaker, {})[
+            str(session_.key.id())] = session_.name
+
+
+def _removeSession(index, session_):
+    """Remove a Session from the index (in memory)."""
+    speaker_sessions = index.sessions.get(session_.speaker)
+    if speaker_sessions is not None:
+        speaker_sessions.pop(str(session_.key.id()), None)
+        if not speaker_sessions:
+            del index.sessions[session_.speaker]
+
+
+def _chooseFeaturedSpeaker(index, candidates=()):
+    """Pick the featured speaker: the last of the candidates (speakers of
+    just written sessions) with more than one session, else the current one
+    if still eligible, else the speaker with the most sessions (if more than
+    one)."""
+
+    def eligible(speaker):
+        return len(index.sessions.get(speaker, ())) > 1
+
+    for speaker in reversed(candidates):
+        if eligible(speaker):
+            return speaker
+    if index.featuredSpeaker and eligible(index.featuredSpeaker):
+        return index.featuredSpeaker
+    if index.sessions:
+        speaker = max(index.sessions, key=lambda sp: len(index.sessions[sp]))
+        if eligible(speaker):
+            return speaker
+    return None
+
+
+def _buildSpeakerIndex(c_key):
+    """Build a Conference's SpeakerIndex from its Sessions (for conferences
+    from before the index)."""
+
+    index = SpeakerIndex(key=speakerIndexKey(c_key), sessions={})
+    for session_ in Session.query(ancestor=c_key):
+        _addSession(index, session_)
+    index.featuredSpeaker = _chooseFeaturedSpeaker(index)
+    return index
+
+
+def _getSpeakerIndex(c_key):
+    """Return the Conference's SpeakerIndex, building it if it doesn't exist
+    yet. Must be called in a transaction on the Conference's entity group.
+    """
+
+    index = speakerIndexKey(c_key).get()
+    if not index:
+        return _buildSpeakerIndex(c_key)
+    if index.sessions is None:
+        index.sessions = {}
+    return index
+
+
+@ndb.transactional
+def loadSpeakerIndex(c_key):
+    """Return the Conference's SpeakerIndex, building and storing it if it
+    doesn't exist yet."""
+
+    index = speakerIndexKey(c_key).get()
+    if not index:
+        index = _buildSpeakerIndex(c_key)
+        index.put()
+    return index
+
+
+def speakerId(name):
+    """Return the normalized identity of a speaker name ("John  Smith",
+    "john smith." -> "john smith"), or None if there is no speaker."""
+
+    if not name:
+        return None
+    s_id = u' '.join(re.sub(r'[^\w\s]', u' ', name,
+                            flags=re.UNICODE).lower().split())
+    if not s_id or s_id == NO_SPEAKER:
+        return None
+    return s_id
+
+
+def speakerKey(name):
+    """Return the key of the named speaker's Speaker, or None."""
+
+    s_id = speakerId(name)
+    return ndb.Key(Speaker, s_id) if s_id else None
+
+
+def _speakerChanges(added=(), removed=()):
+    """Return the changes to Speakers for Sessions added and removed, as
+    {speaker id: {'name': name, 'add': [wssk], 'remove': [wssk]}}."""
+
+    changes = {}
+
+    def change(session_):
+        s_id = speakerId(session_.speaker)
+        if s_id:
+            return changes.setdefault(s_id, {'name': session_.speaker,
+                                             'add': [], 'remove': []})
+
+    for session_ in removed:
+        entry = change(session_)
+        if entry:
+            entry['remove'].append(session_.key.urlsafe())
+    for session_ in added:
+        entry = change(session_)
+        if entry:
+            entry['name'] = session_.speaker
+            entry['add'].append(session_.key.urlsafe())
+    return changes
+
+
+def _enqueueSpeakerChanges(changes):
+    """Enqueue a task applying the changes to Speakers (transactionally, if
+    in a transaction)."""
+
+    if changes:
+        taskqueue.add(url=UPDATE_SPEAKERS_URL, payload=json.dumps(changes),
+                      transactional=ndb.in_transaction())
+
+
+@ndb.transactional
+def putSessions(c_key, sessions, is_new=True):
+    """Put Sessions of one Conference together with its updated SpeakerIndex
+    and Schedule in a single transaction; returns the index.
+
+    For edits (is_new=False) the stored copies are read first so the
+    Sessions' old speakers are un-indexed. Raises ScheduleFullError (see
+    schedules.py) if the Conference can't take the Sessions.
+    """
+
+    index = _getSpeakerIndex(c_key)
+    removed = []
+    if not is_new:
+        removed = [old for old in ndb.get_multi(
+                       [session_.key for session_ in sessions]) if old]
+        for old in removed:
+            _removeSession(index, old)
+    for session_ in sessions:
+        _addSession(index, session_)
+    index.featuredSpeaker = _chooseFeaturedSpeaker(
+        index, [session_.speaker for session_ in sessions])
+    schedule = getSchedule(c_key)
+    updateSchedule(schedule, added=sessions)
+    ndb.put_multi(list(sessions) + [index, schedule])
+    _enqueueSpeakerChanges(_speakerChanges(sessions, removed))
+    return index
+
+
+@ndb.transactional
+def deleteSessions(c_key, s_keys):
+    """Delete Sessions of one Conference and take them off its SpeakerIndex
+    and Schedule, in a single transaction; returns the index."""
+
+    index = _getSpeakerIndex(c_key)
+    removed = [old for old in ndb.get_multi(s_keys) if old]
+    for old in removed:
+        _removeSession(index, old)
+    index.featuredSpeaker = _chooseFeaturedSpeaker(index)
+    schedule = getSchedule(c_key)
+    updateSchedule(schedule, removed_keys=s_keys)
+    ndb.delete_multi(s_keys)
+    # (a schedule built here may be too large to store, see schedules.py)
+    ndb.put_multi([index, schedule] if scheduleFits(schedule) else [index])
+    _enqueueSpeakerChanges(_speakerChanges(removed=removed))
+    return index
+
+
+@ndb.transactional
+def _updateSpeaker(s_id, name, added, removed):
+    key = ndb.Key(Speaker, s_id)
+    speaker = key.get()
+    session_keys = speaker.sessionKeys if speaker else []
+
+    removed = set(removed)
+    session_keys = [s_key for s_key in session_keys if s_key not in removed]
+    present = set(session_keys)
+    session_keys.extend(s_key for s_key in added if s_key not in present)
+
+    if session_keys:
+        Speaker(key=key, name=name or speaker.name,
+                sessionKeys=session_keys).put()
+    elif speaker:
+        key.delete()
+
+
+def updateSpeakers(changes):
+    """Apply changes made by _speakerChanges to the Speakers, one
+    transaction per Speaker (removals first, so re-applying is harmless).
+    """
+
+    for s_id, change in changes.items():
+        _updateSpeaker(s_id, change['name'],
+                       [ndb.Key(urlsafe=wssk) for wssk in change['add']],
+                       [ndb.Key(urlsafe=wssk) for wssk in change['remove']])
+
+
+def addSpeakerSessions(sessions, replaced=()):
+    """Add stored Sessions to their Speakers, and remove the replaced
+    (previously stored) copies of them, outside of a transaction (for
+    imports and the backfill)."""
+    updateSpeakers(_speakerChanges(sessions, replaced))
+
+
+def featuredSpeakerText(index):
+    """Return the featured speaker announcement for the index, or None."""
+
+    speaker = index.featuredSpeaker
+    if not speaker or speaker not in index.sessions:
+        return None
+    session_names = index.sessions[speaker]
+    names = [session_names[s_id] for s_id in sorted(session_names, key=int)]
+    return u"Featured Speaker: {}. Sessions: {}".format(speaker,
+                                                       u', '.join(names))
+
+
+def cacheFeaturedSpeaker(c_key, index=None):
+    """Set (or clear) the Conference's featured speaker entry in memcache
+    from its SpeakerIndex; returns the entry."""
+
+    if index is None:
+        index = loadSpeakerIndex(c_key)
+    text = featuredSpeakerText(index)
+    memcache_key = MEMCACHE_FEATURED_SPEAKER_KEY + c_key.urlsafe()
+    if text:
+        memcache.set(memcache_key, text)
+    else:
+        memcache.delete(memcache_key)
+    return text
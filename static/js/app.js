@@ -76,6 +76,48 @@ app.constant('HTTP_ERRORS', {
 });
 
 
+/**
+ * @ngdoc service
+ * @name conditionalGet
+ *
+ * @description
+ * Calls an API read method (getProfile, getConference, getConferenceSessions) with the etag of
+ * its last response, and hands the callback a copy of that response again when the server
+ * answers that nothing has changed (notModified).
+ *
+ */
+app.factory('conditionalGet', function () {
+    var responses = {};
+
+    var conditionalGet = function (method, params, callback) {
+        var cacheKey = method + ':' + angular.toJson(params);
+        var cached = responses[cacheKey];
+        var request = angular.extend({}, params);
+        if (cached) {
+            request.ifNoneMatch = cached.result.etag;
+        }
+        gapi.client.conference[method](request).execute(function (resp) {
+            // the callback gets a copy, so its changes don't reach the cache
+            if (!resp.error && resp.result.notModified && cached) {
+                resp = angular.copy(cached);
+            } else if (!resp.error && resp.result.etag) {
+                responses[cacheKey] = angular.copy(resp);
+            }
+            callback(resp);
+        });
+    };
+
+    /**
+     * Forgets the cached responses (e.g. when the user signs out).
+     */
+    conditionalGet.clear = function () {
+        responses = {};
+    };
+
+    return conditionalGet;
+});
+
+
 /**
  * @ngdoc service
  * @name oauth2Provider
@@ -84,7 +126,7 @@ app.constant('HTTP_ERRORS', {
  * Service that holds the OAuth2 information shared across all the pages.
  *
  */
-app.factory('oauth2Provider', function ($modal) {
+app.factory('oauth2Provider', function ($modal, conditionalGet) {
     var oauth2Provider = {
         CLIENT_ID: '822372758669-dg63tfrlljkhpb6hmcvtno3hagjg1812.apps.googleusercontent.com',
         SCOPES: 'email profile',
@@ -110,6 +152,7 @@ app.factory('oauth2Provider', function ($modal) {
      */
     oauth2Provider.signOut = function () {
         gapi.auth.signOut();
+        conditionalGet.clear();
         // Explicitly set the invalid access token in order to make the API calls fail.
         gapi.auth.setToken({access_token: ''});
         oauth2Provider.signedIn = false;
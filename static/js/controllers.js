@@ -25,7 +25,7 @@ conferenceApp.controllers = angular.module('conferenceControllers', ['ui.bootstr
  * A controller used for the My Profile page.
  */
 conferenceApp.controllers.controller('MyProfileCtrl',
-    function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+    function ($scope, $log, oauth2Provider, conditionalGet, HTTP_ERRORS) {
         $scope.submitted = false;
         $scope.loading = false;
 
@@ -63,21 +63,19 @@ conferenceApp.controllers.controller('MyProfileCtrl',
             var retrieveProfileCallback = function () {
                 $scope.profile = {};
                 $scope.loading = true;
-                gapi.client.conference.getProfile().
-                    execute(function (resp) {
-                        $scope.$apply(function () {
-                            $scope.loading = false;
-                            if (resp.error) {
-                                // Failed to get a user profile.
-                            } else {
-                                // Succeeded to get the user profile.
-                                $scope.profile.displayName = resp.result.displayName;
-                                $scope.profile.teeShirtSize = resp.result.teeShirtSize;
-                                $scope.initialProfile = resp.result;
-                            }
-                        });
-                    }
-                );
+                conditionalGet('getProfile', {}, function (resp) {
+                    $scope.$apply(function () {
+                        $scope.loading = false;
+                        if (resp.error) {
+                            // Failed to get a user profile.
+                        } else {
+                            // Succeeded to get the user profile.
+                            $scope.profile.displayName = resp.result.displayName;
+                            $scope.profile.teeShirtSize = resp.result.teeShirtSize;
+                            $scope.initialProfile = resp.result;
+                        }
+                    });
+                });
             };
             if (!oauth2Provider.signedIn) {
                 var modalInstance = oauth2Provider.showLoginModal();
@@ -346,15 +344,61 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     $scope.pagination = $scope.pagination || {};
     $scope.pagination.currentPage = 0;
     $scope.pagination.pageSize = 20;
+
+    /**
+     * Holds the page tokens returned by conference.queryConferences; pageTokens[n] fetches page n.
+     * Only used by the 'ALL' tab, which is paged on the server.
+     * @type {Array}
+     */
+    $scope.pagination.pageTokens = [null];
+
+    /**
+     * Returns if the current tab is paged on the server rather than sliced locally.
+     *
+     * @returns {boolean}
+     */
+    $scope.pagination.isServerSide = function () {
+        return $scope.selectedTab == 'ALL';
+    };
+
     /**
      * Returns the number of the pages in the pagination.
+     * For server side paging, only the pages reached so far (plus the next one) are known.
      *
      * @returns {number}
      */
     $scope.pagination.numberOfPages = function () {
+        if ($scope.pagination.isServerSide()) {
+            return $scope.pagination.pageTokens.length;
+        }
         return Math.ceil($scope.conferences.length / $scope.pagination.pageSize);
     };
 
+    /**
+     * Returns the index of the first conference of the current page in $scope.conferences.
+     *
+     * @returns {number}
+     */
+    $scope.pagination.offset = function () {
+        if ($scope.pagination.isServerSide()) {
+            return 0;
+        }
+        return $scope.pagination.currentPage * $scope.pagination.pageSize;
+    };
+
+    /**
+     * Moves to the given page, fetching it from the server if the tab is paged on the server.
+     *
+     * @param page the index of the page.
+     */
+    $scope.pagination.goToPage = function (page) {
+        if ($scope.pagination.isServerSide()) {
+            $scope.queryConferencesAll(page);
+        } else {
+            $scope.pagination.currentPage = page;
+        }
+    };
+
     /**
      * Returns an array including the numbers from 1 to the number of the pages.
      *
@@ -414,6 +458,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.queryConferences = function () {
         $scope.submitted = false;
+        $scope.pagination.currentPage = 0;
         if ($scope.selectedTab == 'ALL') {
             $scope.queryConferencesAll();
         } else if ($scope.selectedTab == 'YOU_HAVE_CREATED') {
@@ -424,11 +469,23 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     };
 
     /**
-     * Invokes the conference.queryConferences API.
+     * Invokes the conference.queryConferences API for a single page.
+     * Each page is sorted by name, but with filters set the pages don't follow each other in
+     * name order (they follow the filtered field, or no particular order for equality filters).
+     *
+     * @param page the index of the page to fetch; starts a new query from the first page if omitted.
      */
-    $scope.queryConferencesAll = function () {
+    $scope.queryConferencesAll = function (page) {
+        if (page === undefined) {
+            page = 0;
+            $scope.pagination.pageTokens = [null];
+        }
         var sendFilters = {
-            filters: []
+            filters: [],
+            pageSize: $scope.pagination.pageSize
+        }
+        if ($scope.pagination.pageTokens[page]) {
+            sendFilters.pageToken = $scope.pagination.pageTokens[page];
         }
         for (var i = 0; i < $scope.filters.length; i++) {
             var filter = $scope.filters[i];
@@ -462,6 +519,16 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         angular.forEach(resp.items, function (conference) {
                             $scope.conferences.push(conference);
                         });
+
+                        // filtered pages are each sorted by name, but don't follow each other in name order.
+                        $scope.pagination.filtered = sendFilters.filters.length > 0;
+
+                        // keep the tokens up to this page, plus the one for the next page if there is one.
+                        $scope.pagination.currentPage = page;
+                        $scope.pagination.pageTokens = $scope.pagination.pageTokens.slice(0, page + 1);
+                        if (resp.result.nextPageToken) {
+                            $scope.pagination.pageTokens.push(resp.result.nextPageToken);
+                        }
                     }
                     $scope.submitted = true;
                 });
@@ -547,7 +614,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
  * @description
  * A controller used for the conference detail page.
  */
-conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, conditionalGet, HTTP_ERRORS) {
     $scope.conference = {};
 
     $scope.isUserAttending = false;
@@ -559,9 +626,9 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
      */
     $scope.init = function () {
         $scope.loading = true;
-        gapi.client.conference.getConference({
+        conditionalGet('getConference', {
             websafeConferenceKey: $routeParams.websafeConferenceKey
-        }).execute(function (resp) {
+        }, function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
                 if (resp.error) {
@@ -581,7 +648,7 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
 
         $scope.loading = true;
         // If the user is attending the conference, updates the status message and available function.
-        gapi.client.conference.getProfile().execute(function (resp) {
+        conditionalGet('getProfile', {}, function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
                 if (resp.error) {
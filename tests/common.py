@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+"""common.py
+Shared setup for the Conference Central tests
+
+The tests run fully offline on the App Engine testbed stubs. Run them from
+the app directory with the App Engine SDK on PYTHONPATH, e.g.:
+
+    PYTHONPATH=$APPENGINE_SDK python -m unittest discover tests '*_test.py'
+"""
+
+import os
+import sys
+import unittest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+# put the SDK's bundled libraries (webapp2, endpoints, ...) on the path:
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+
+class TestbedTestCase(unittest.TestCase):
+    """A test case running on fresh datastore, memcache, taskqueue, mail
+    and search stubs."""
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=APP_DIR)
+        self.testbed.init_urlfetch_stub()
+        self.testbed.init_app_identity_stub()
+        self.testbed.init_mail_stub()
+        self.testbed.init_search_stub()
+        ndb.get_context().clear_cache()
+        self._patched = []
+
+    def tearDown(self):
+        for obj, name, value in reversed(self._patched):
+            setattr(obj, name, value)
+        self.testbed.deactivate()
+
+    def patch(self, obj, name, value):
+        """Replace obj.name with value until the test ends."""
+
+        self._patched.append((obj, name, getattr(obj, name)))
+        setattr(obj, name, value)
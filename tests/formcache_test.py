@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+"""formcache_test.py
+Tests for the form cache (formcache.py) and the etags derived from it"""
+
+import unittest
+
+import common
+
+import formcache
+from conference import ConferenceApi
+from models import ConferenceForm
+
+WSCK = 'conference-key'
+
+
+class ReadThroughTest(common.TestbedTestCase):
+
+    def setUp(self):
+        super(ReadThroughTest, self).setUp()
+        self.builds = 0
+
+    def _readConference(self, name, invalidate=False):
+        def build():
+            self.builds += 1
+            form = ConferenceForm(name=name)
+            if invalidate:
+                # a write commits after this build read the conference, but
+                # before the form is cached:
+                formcache.invalidate('conference', WSCK)
+            return form
+        return formcache.readThrough('conference', WSCK, ConferenceForm,
+                                     build)
+
+    def testCachesForm(self):
+        self._readConference('first')
+        self.assertEqual('first', self._readConference('second').name)
+        self.assertEqual(1, self.builds)
+
+    def testInvalidateDropsForm(self):
+        self._readConference('first')
+        formcache.invalidate('conference', WSCK)
+        self.assertEqual('second', self._readConference('second').name)
+        self.assertEqual(2, self.builds)
+
+    def testInvalidateBetweenBuildAndSet(self):
+        self._readConference('stale', invalidate=True)
+        # the stale form must not be served after the invalidation:
+        self.assertEqual('fresh', self._readConference('fresh').name)
+        self.assertEqual(2, self.builds)
+
+    def testEtagNeverNewerThanForm(self):
+        api = ConferenceApi()
+
+        def read(name, invalidate=False):
+            return api._conditionalRead(
+                'conference', WSCK, None, ConferenceForm,
+                lambda: self._readConference(name, invalidate))
+
+        stale = read('stale', invalidate=True)
+        fresh = read('fresh')
+        self.assertEqual('fresh', fresh.name)
+        # the stale form's etag is out of date, so it isn't kept:
+        self.assertNotEqual(stale.etag, fresh.etag)
+        not_modified = api._conditionalRead(
+            'conference', WSCK, fresh.etag, ConferenceForm,
+            lambda: self.fail('read although not modified'))
+        self.assertTrue(not_modified.notModified)
+
+
+if __name__ == '__main__':
+    unittest.main()
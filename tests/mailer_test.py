@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+"""mailer_test.py
+Tests for batched mail delivery (mailer.py)"""
+
+import json
+import unittest
+
+import common
+
+from google.appengine.api import mail
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import testbed
+
+import mailer
+
+TO = 'organizer@example.com'
+
+
+class SendQueuedMailTest(common.TestbedTestCase):
+
+    def setUp(self):
+        super(SendQueuedMailTest, self).setUp()
+        self.sendMail = mail.send_mail
+        self.failures = 0
+        self.failuresLeft = 0
+        self.patch(mail, 'send_mail', self._sendMail)
+        # retried and deferred messages can be leased again at once:
+        self.patch(mailer, 'BACKOFF_SECONDS', 0)
+        for i in range(3):
+            mailer.queueMail(TO, 'Subject %d' % i, 'Body %d' % i)
+
+    def _sendMail(self, *args, **kwargs):
+        if self.failuresLeft:
+            self.failuresLeft -= 1
+            self.failures += 1
+            raise mail.InvalidSenderError('failing')
+        return self.sendMail(*args, **kwargs)
+
+    def _sentMessages(self):
+        return self.testbed.get_stub(
+            testbed.MAIL_SERVICE_NAME).get_sent_messages(to=TO)
+
+    def _queuedMessages(self):
+        tasks = taskqueue.Queue(mailer.MAIL_QUEUE).lease_tasks(1, 100)
+        return [json.loads(task.payload) for task in tasks]
+
+    def testSendsOneMailPerRecipient(self):
+        self.assertEqual(1, mailer.sendQueuedMail())
+        sent = self._sentMessages()
+        self.assertEqual(1, len(sent))
+        self.assertEqual('Subject 0 (and 2 more)', sent[0].subject)
+        self.assertEqual([], self._queuedMessages())
+
+    def testRetriesFailedSend(self):
+        self.failuresLeft = 1
+        self.assertEqual(1, mailer.sendQueuedMail())
+        self.assertEqual(1, self.failures)
+        self.assertEqual(1, len(self._sentMessages()))
+        self.assertEqual([], self._queuedMessages())
+
+    def testDropsAfterMaxAttempts(self):
+        self.failuresLeft = mailer.MAX_MAIL_ATTEMPTS + 1
+        self.assertEqual(0, mailer.sendQueuedMail())
+        self.assertEqual(mailer.MAX_MAIL_ATTEMPTS, self.failures)
+        self.assertEqual([], self._sentMessages())
+        self.assertEqual([], self._queuedMessages())
+
+    def testDeferralsAreNotAttempts(self):
+        # the recipient was just mailed; each lease of the run is deferred
+        self.patch(mailer, 'RECIPIENT_INTERVAL_SECONDS', 0)
+        memcache.set(mailer.MEMCACHE_MAIL_SENT_KEY + TO, 1)
+        self.assertEqual(0, mailer.sendQueuedMail())
+
+        # a real failure then is the messages' first, not their last:
+        memcache.delete(mailer.MEMCACHE_MAIL_SENT_KEY + TO)
+        self.failuresLeft = 1
+        self.assertEqual(1, mailer.sendQueuedMail())
+        self.assertEqual(1, self.failures)
+        self.assertEqual(1, len(self._sentMessages()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+"""utils_test.py
+Tests for local ID token verification (utils.verifyIdToken, getUserId)"""
+
+import base64
+import json
+import os
+import time
+import unittest
+
+import common
+
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import RSA
+from Crypto.Signature import PKCS1_v1_5
+from google.appengine.api import memcache
+from google.appengine.api import urlfetch
+
+import utils
+from settings import WEB_CLIENT_ID
+
+AUDIENCE = WEB_CLIENT_ID
+KID = 'test-key'
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+def _longToB64(value):
+    digits = '%x' % value
+    return _b64encode(('0' * (len(digits) % 2) + digits).decode('hex'))
+
+
+class _Response(object):
+
+    def __init__(self, status_code, content, headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+
+class VerifyIdTokenTest(common.TestbedTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.key = RSA.generate(2048)
+        cls.otherKey = RSA.generate(2048)
+
+    def setUp(self):
+        super(VerifyIdTokenTest, self).setUp()
+        self.patch(utils, '_certs', {'keys': {}, 'expires': 0,
+                                     'refreshed': 0, 'failures': 0})
+        self.patch(utils, '_verified_tokens', {})
+        self.fetches = 0
+        self.fetchError = None
+        self.tokenInfo = None
+        self.tokenInfoLookups = 0
+        self.patch(urlfetch, 'fetch', self._fetch)
+
+    def _fetch(self, url):
+        if url.startswith('https://www.googleapis.com/oauth2/v1/tokeninfo'):
+            self.tokenInfoLookups += 1
+            if self.tokenInfo is None:
+                return _Response(400, '{"error": "invalid_token"}')
+            return _Response(200, json.dumps(self.tokenInfo))
+        self.fetches += 1
+        if self.fetchError:
+            raise self.fetchError
+        jwk = {'kid': KID, 'kty': 'RSA', 'alg': 'RS256',
+               'n': _longToB64(self.key.n), 'e': _longToB64(self.key.e)}
+        return _Response(200, json.dumps({'keys': [jwk]}),
+                         {'Cache-Control': 'public, max-age=3600'})
+
+    def _token(self, key=None, kid=KID, **claims):
+        now = int(time.time())
+        payload = {'iss': 'accounts.google.com', 'aud': AUDIENCE,
+                   'sub': '1234', 'iat': now, 'exp': now + 3600}
+        payload.update(claims)
+        signing_input = '%s.%s' % (
+            _b64encode(json.dumps({'alg': 'RS256', 'kid': kid})),
+            _b64encode(json.dumps(payload)))
+        signature = PKCS1_v1_5.new(key or self.key).sign(
+            SHA256.new(signing_input))
+        return '%s.%s' % (signing_input, _b64encode(signature))
+
+    def testValidToken(self):
+        payload = utils.verifyIdToken(self._token(), AUDIENCE)
+        self.assertEqual('1234', payload['sub'])
+
+    def testBadSignature(self):
+        self.assertIsNone(utils.verifyIdToken(
+            self._token(key=self.otherKey), AUDIENCE))
+
+    def testWrongAudience(self):
+        self.assertIsNone(utils.verifyIdToken(
+            self._token(aud='someone-else'), AUDIENCE))
+
+    def testWrongIssuer(self):
+        self.assertIsNone(utils.verifyIdToken(
+            self._token(iss='evil.example.com'), AUDIENCE))
+
+    def testExpired(self):
+        now = int(time.time())
+        self.assertIsNone(utils.verifyIdToken(
+            self._token(iat=now - 7200, exp=now - 3600), AUDIENCE))
+
+    def testCertsAreCached(self):
+        utils.verifyIdToken(self._token(), AUDIENCE)
+        utils.verifyIdToken(self._token(), AUDIENCE)
+        self.assertEqual(1, self.fetches)
+
+    def testFailedFetchKeepsKeysAndBacksOff(self):
+        self.assertIsNotNone(utils.verifyIdToken(self._token(), AUDIENCE))
+        # the keys expire and Google can't be reached:
+        utils._certs['expires'] = 0
+        memcache.flush_all()
+        self.fetchError = urlfetch.DownloadError('unreachable')
+        self.assertIsNotNone(utils.verifyIdToken(self._token(), AUDIENCE))
+        self.assertIsNotNone(utils.verifyIdToken(self._token(), AUDIENCE))
+        # one failed fetch, then none until the back off is over:
+        self.assertEqual(2, self.fetches)
+
+        self.fetchError = None
+        utils._certs['expires'] = 0
+        self.assertIsNotNone(utils.verifyIdToken(self._token(), AUDIENCE))
+        self.assertEqual(3, self.fetches)
+        self.assertEqual(0, utils._certs['failures'])
+
+    def testUnknownKeyIdIsUnverifiable(self):
+        self.assertRaises(utils.TokenUnverifiableError, utils.verifyIdToken,
+                          self._token(kid='rotated-key'), AUDIENCE)
+
+    def testNoCertsIsUnverifiable(self):
+        self.fetchError = urlfetch.DownloadError('unreachable')
+        self.assertRaises(utils.TokenUnverifiableError, utils.verifyIdToken,
+                          self._token(), AUDIENCE)
+
+    def _getUserId(self, token):
+        self.patch(os, 'environ', {'HTTP_AUTHORIZATION': 'Bearer ' + token})
+        return utils.getUserId(None, id_type='oauth')
+
+    def testGetUserIdFromIdToken(self):
+        self.assertEqual('1234', self._getUserId(self._token()))
+        self.assertEqual(0, self.tokenInfoLookups)
+
+    def testGetUserIdRejectsInvalidIdTokens(self):
+        now = int(time.time())
+        self.tokenInfo = {'user_id': '1234', 'audience': 'someone-else',
+                          'expires_in': 3600}
+        for token in (self._token(aud='someone-else'),
+                      self._token(key=self.otherKey),
+                      self._token(iat=now - 7200, exp=now - 3600)):
+            self.assertEqual('', self._getUserId(token))
+        # rejected locally, without asking tokeninfo:
+        self.assertEqual(0, self.tokenInfoLookups)
+
+    def testGetUserIdFallsBackForUnverifiableIdTokens(self):
+        token = self._token(kid='rotated-key')
+        self.tokenInfo = {'user_id': '1234', 'audience': 'someone-else',
+                          'expires_in': 3600}
+        self.assertEqual('', self._getUserId(token))
+        self.tokenInfo['audience'] = WEB_CLIENT_ID
+        self.assertEqual('1234', self._getUserId(token))
+        self.assertEqual(2, self.tokenInfoLookups)
+
+    def testGetUserIdFromAccessToken(self):
+        self.tokenInfo = {'user_id': '5678', 'audience': WEB_CLIENT_ID,
+                          'expires_in': 3600}
+        self.assertEqual('5678', self._getUserId('ya29.opaque-token'))
+        self.tokenInfo = None
+        self.assertEqual('', self._getUserId('ya29.another-token'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+"""textsearch.py
+Full-text search over Conferences and Sessions (App Engine Search API)
+
+Conferences are indexed by name, description and topics, Sessions by name,
+highlights and speaker; documents are keyed by the entity's websafe key.
+Documents are updated as entities are written (or deleted); if the Search
+API fails, a task retries indexing those entities. Searches return the
+matching keys, best matches first, a page at a time.
+"""
+
+import logging
+
+from google.appengine.api import search
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+CONFERENCE_INDEX = 'conferences'
+SESSION_INDEX = 'sessions'
+MAX_DOCUMENTS_PER_CALL = 200
+MAX_SEARCH_PAGE_SIZE = 100
+# how many matches are ranked (scored) per search
+MAX_SCORED_MATCHES = 1000
+
+
+def _conferenceDocument(conf):
+    return search.Document(doc_id=conf.key.urlsafe(), fields=[
+        search.TextField(name='name', value=conf.name),
+        search.TextField(name='description', value=conf.description),
+        search.TextField(name='topics', value=' '.join(conf.topics or [])),
+    ])
+
+
+def _sessionDocument(session_):
+    return search.Document(doc_id=session_.key.urlsafe(), fields=[
+        search.TextField(name='name', value=session_.name),
+        search.TextField(name='highlights',
+                         value=' '.join(session_.highlights or [])),
+        search.TextField(name='speaker', value=session_.speaker),
+    ])
+
+
+DOCUMENTS = {
+    CONFERENCE_INDEX: _conferenceDocument,
+    SESSION_INDEX: _sessionDocument,
+}
+
+
+def _chunks(items):
+    for i in range(0, len(items), MAX_DOCUMENTS_PER_CALL):
+        yield items[i:i + MAX_DOCUMENTS_PER_CALL]
+
+
+def _index(index_name, entities):
+    """Put the entities' documents into the index; on failure, enqueue a
+    task to retry."""
+
+    index = search.Index(name=index_name)
+    for chunk in _chunks(list(entities)):
+        try:
+            index.put([DOCUMENTS[index_name](entity) for entity in chunk])
+        except search.Error:
+            logging.exception('Indexing in %s failed; retrying in a task',
+                              index_name)
+            taskqueue.add(params={'index': index_name,
+                                  'keys': [e.key.urlsafe() for e in chunk]},
+                          url='/tasks/index_documents')
+
+
+def indexConferences(conferences):
+    """Add or update the Conferences in the search index."""
+    _index(CONFERENCE_INDEX, conferences)
+
+
+def indexSessions(sessions):
+    """Add or update the Sessions in the search index."""
+    _index(SESSION_INDEX, sessions)
+
+
+def unindexSessions(s_keys):
+    """Remove Sessions from the search index; on failure, enqueue a task to
+    retry (reindexing deleted Sessions removes their documents)."""
+
+    index = search.Index(name=SESSION_INDEX)
+    for chunk in _chunks(list(s_keys)):
+        websafe_keys = [s_key.urlsafe() for s_key in chunk]
+        try:
+            index.delete(websafe_keys)
+        except search.Error:
+            logging.exception('Unindexing from %s failed; retrying in a '
+                              'task', SESSION_INDEX)
+            taskqueue.add(params={'index': SESSION_INDEX,
+                                  'keys': websafe_keys},
+                          url='/tasks/index_documents')
+
+
+def reindex(index_name, websafe_keys):
+    """Index the entities with the websafe keys again (documents of
+    entities that no longer exist are removed)."""
+
+    keys = [ndb.Key(urlsafe=wsk) for wsk in websafe_keys]
+    entities = ndb.get_multi(keys)
+    _index(index_name, [entity for entity in entities if entity])
+    gone = [key.urlsafe() for key, entity in zip(keys, entities)
+            if not entity]
+    if gone:
+        search.Index(name=index_name).delete(gone)
+
+
+def _search(index_name, query_string, page_size, page_token):
+    """Return (keys, next_page_token) of a page of the index's documents
+    matching the query, best matches first.
+
+    Raises search.QueryError for a bad query and ValueError for a bad
+    page_token.
+    """
+
+    query = search.Query(
+        query_string=query_string,
+        options=search.QueryOptions(
+            limit=min(page_size or MAX_SEARCH_PAGE_SIZE,
+                      MAX_SEARCH_PAGE_SIZE),
+            cursor=search.Cursor(web_safe_string=page_token or None),
+            ids_only=True,
+            sort_options=search.SortOptions(
+                match_scorer=search.MatchScorer(),
+                expressions=[search.SortExpression(
+                    expression='_score',
+                    direction=search.SortExpression.DESCENDING,
+                    default_value=0)],
+                limit=MAX_SCORED_MATCHES)))
+    results = search.Index(name=index_name).search(query)
+
+    keys = [ndb.Key(urlsafe=doc.doc_id) for doc in results.results]
+    next_page_token = None
+    if results.cursor:
+        next_page_token = results.cursor.web_safe_string
+    return keys, next_page_token
+
+
+def searchConferences(query_string, page_size=None, page_token=None):
+    """Return (Conference keys, next_page_token) matching the query."""
+    return _search(CONFERENCE_INDEX, query_string, page_size, page_token)
+
+
+def searchSessions(query_string, page_size=None, page_token=None):
+    """Return (Session keys, next_page_token) matching the query."""
+    return _search(SESSION_INDEX, query_string, page_size, page_token)
@@ -1,10 +1,203 @@
+import base64
+import hashlib
 import json
+import logging
 import os
+import re
 import time
 import uuid
 
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import RSA
+from Crypto.Signature import PKCS1_v1_5
+from google.appengine.api import memcache
 from google.appengine.api import urlfetch
 from models import Profile
+from settings import WEB_CLIENT_ID
+
+GOOGLE_CERTS_URL = 'https://www.googleapis.com/oauth2/v3/certs'
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+MEMCACHE_CERTS_KEY = 'google_oauth2_certs'
+MEMCACHE_TOKEN_KEY = 'verified_token_'
+DEFAULT_CERTS_SECONDS = 3600
+CLOCK_SKEW_SECONDS = 300
+MIN_CERTS_REFRESH_SECONDS = 60
+CERTS_RETRY_SECONDS = 10
+MAX_CERTS_RETRY_SECONDS = 600
+MAX_CACHED_TOKENS = 1000
+
+# in-process caches, shared by the requests an instance serves:
+# {'keys': {kid: RSA key}, 'expires': timestamp, 'refreshed': timestamp,
+#  'failures': failed fetches in a row}
+_certs = {'keys': {}, 'expires': 0, 'refreshed': 0, 'failures': 0}
+# {token hash: (user id, expires timestamp)}
+_verified_tokens = {}
+
+
+def _b64decode(segment):
+    """Decode a base64url JWT segment (which has its padding stripped)."""
+    return base64.urlsafe_b64decode(str(segment) + '=' * (-len(segment) % 4))
+
+
+def _b64toLong(segment):
+    """Decode a base64url JWK integer (big endian) to a long."""
+    return long(_b64decode(segment).encode('hex'), 16)
+
+
+def _fetchCerts():
+    """Fetch Google's signing keys (as JWKs) and return them along with the
+    time they may be cached for (from the Cache-Control header); or None if
+    they can't be fetched."""
+    try:
+        resp = urlfetch.fetch(GOOGLE_CERTS_URL)
+        if resp.status_code != 200:
+            return None
+        jwks = json.loads(resp.content)
+        keys = dict((jwk['kid'], (jwk['n'], jwk['e']))
+                    for jwk in jwks.get('keys', []))
+    except (urlfetch.Error, ValueError, KeyError, TypeError, AttributeError):
+        logging.warning('Could not fetch %s', GOOGLE_CERTS_URL, exc_info=True)
+        return None
+    if not keys:
+        return None
+    max_age = re.search(r'max-age=(\d+)',
+                        resp.headers.get('Cache-Control', ''))
+    seconds = int(max_age.group(1)) if max_age else DEFAULT_CERTS_SECONDS
+    return keys, seconds
+
+
+def _getCerts(refresh=False):
+    """Return Google's signing keys by key id, cached in process and in
+    memcache until they expire. A refresh (for an unknown key id) is done at
+    most once per MIN_CERTS_REFRESH_SECONDS.
+
+    If the keys can't be fetched, the ones we have are kept, and the fetch
+    is retried after CERTS_RETRY_SECONDS, doubling (up to
+    MAX_CERTS_RETRY_SECONDS) while it keeps failing."""
+    now = time.time()
+    if refresh:
+        if _certs['refreshed'] > now - MIN_CERTS_REFRESH_SECONDS:
+            return _certs['keys']
+        _certs['refreshed'] = now
+    elif _certs['expires'] > now:
+        return _certs['keys']
+
+    cached = None if refresh else memcache.get(MEMCACHE_CERTS_KEY)
+    if cached:
+        jwks, expires = cached
+    else:
+        fetched = _fetchCerts()
+        if fetched is None:
+            # keep the keys we have; back off before fetching again
+            _certs['expires'] = now + min(
+                CERTS_RETRY_SECONDS * 2 ** _certs['failures'],
+                MAX_CERTS_RETRY_SECONDS)
+            _certs['failures'] += 1
+            return _certs['keys']
+        jwks, seconds = fetched
+        expires = now + seconds
+        memcache.set(MEMCACHE_CERTS_KEY, (jwks, expires), time=seconds)
+
+    _certs['keys'] = dict((kid, RSA.construct((_b64toLong(n), _b64toLong(e))))
+                          for kid, (n, e) in jwks.items())
+    _certs['expires'] = expires
+    _certs['failures'] = 0
+    return _certs['keys']
+
+
+def _cacheVerifiedToken(token_hash, user_id, expires):
+    """Remember the user id of a verified token until the token expires."""
+    now = time.time()
+    if expires <= now:
+        return
+    if len(_verified_tokens) >= MAX_CACHED_TOKENS:
+        for key, (_, exp) in _verified_tokens.items():
+            if exp <= now:
+                del _verified_tokens[key]
+        if len(_verified_tokens) >= MAX_CACHED_TOKENS:
+            _verified_tokens.clear()
+    _verified_tokens[token_hash] = (user_id, expires)
+    memcache.set(MEMCACHE_TOKEN_KEY + token_hash, (user_id, expires),
+                 time=int(expires - now) + 1)
+
+
+def _getVerifiedToken(token_hash):
+    """Return the user id of an already verified, unexpired token, or
+    None."""
+    cached = _verified_tokens.get(token_hash)
+    if not cached:
+        cached = memcache.get(MEMCACHE_TOKEN_KEY + token_hash)
+        if cached:
+            _verified_tokens[token_hash] = cached
+    if cached and cached[1] > time.time():
+        return cached[0]
+    return None
+
+
+class TokenUnverifiableError(Exception):
+    """An ID token can't be checked locally: there is no signing key for it
+    (the certs can't be fetched, or don't have its key id)."""
+
+
+def _isJwt(token):
+    """Return whether the token looks like a JWT (an ID token) rather than
+    an opaque access token."""
+    return str(token).count('.') == 2
+
+
+def verifyIdToken(token, audience=WEB_CLIENT_ID):
+    """Verify a Google ID token (a JWT) locally: RS256 signature against
+    Google's certs, issuer, audience and expiry. Returns the payload, or None
+    if the token is not valid; raises TokenUnverifiableError if there is no
+    key to check its signature with."""
+    try:
+        header_seg, payload_seg, signature_seg = str(token).split('.')
+        header = json.loads(_b64decode(header_seg))
+        payload = json.loads(_b64decode(payload_seg))
+        signature = _b64decode(signature_seg)
+    except (ValueError, TypeError):
+        return None
+    if header.get('alg') != 'RS256':
+        return None
+
+    # a key id we don't know means the certs have been rotated:
+    kid = header.get('kid')
+    key = _getCerts().get(kid) or _getCerts(refresh=True).get(kid)
+    if not key:
+        raise TokenUnverifiableError(kid)
+    digest = SHA256.new('%s.%s' % (header_seg, payload_seg))
+    if not PKCS1_v1_5.new(key).verify(digest, signature):
+        return None
+
+    now = time.time()
+    if payload.get('iss') not in GOOGLE_ISSUERS:
+        return None
+    if payload.get('aud') != audience:
+        return None
+    if not (payload.get('iat', 0) - CLOCK_SKEW_SECONDS < now <
+            payload.get('exp', 0) + CLOCK_SKEW_SECONDS):
+        return None
+    return payload
+
+
+def _fetchTokenInfo(token, token_type, audience=WEB_CLIENT_ID):
+    """Look up a token with Google's tokeninfo endpoint, for access tokens
+    and ID tokens that can't be verified locally. Returns its info, or {} if
+    it isn't valid or wasn't issued to the audience."""
+    url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
+           % (token_type, token))
+    try:
+        resp = urlfetch.fetch(url)
+        if resp.status_code != 200:
+            return {}
+        user = json.loads(resp.content)
+    except (urlfetch.Error, ValueError):
+        logging.warning('Token info lookup failed', exc_info=True)
+        return {}
+    if audience not in (user.get('audience'), user.get('aud')):
+        return {}
+    return user
+
 
 def getUserId(user, id_type="email"):
     if id_type == "email":
@@ -15,24 +208,36 @@ def getUserId(user, id_type="email"):
         auth = os.getenv('HTTP_AUTHORIZATION')
         bearer, token = auth.split()
         token_type = 'id_token'
-        if 'OAUTH_USER_ID' in os.environ:
+        if 'OAUTH_USER_ID' in os.environ or not _isJwt(token):
             token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
+
+        # tokens seen before are looked up from the cache:
+        token_hash = hashlib.sha256(token).hexdigest()
+        user_id = _getVerifiedToken(token_hash)
+        if user_id:
+            return user_id
+
+        # ID tokens are verified locally, and rejected if not valid; only
+        # those without a key to check them with go to tokeninfo:
+        if token_type == 'id_token':
+            try:
+                payload = verifyIdToken(token)
+            except TokenUnverifiableError:
+                pass
             else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
+                if not payload:
+                    return ''
+                _cacheVerifiedToken(token_hash, payload['sub'],
+                                    payload['exp'])
+                return payload['sub']
+
+        # access tokens (and unverifiable ID tokens) are looked up remotely:
+        user = _fetchTokenInfo(token, token_type)
+        user_id = user.get('user_id', '')
+        if user_id and 'expires_in' in user:
+            _cacheVerifiedToken(token_hash, user_id,
+                                time.time() + int(user['expires_in']))
+        return user_id
 
     """
     if id_type == "custom":